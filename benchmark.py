@@ -0,0 +1,176 @@
+"""
+Measures how fast the simulator runs each protocol over fixed, seeded configurations, and compares the results to
+stored baselines to catch performance regressions.  Each configuration runs in a fresh process so its peak memory
+is its own, and only the event loop (net.run) is timed.
+
+Usage:
+    ARGS:
+        --suite (json file listing the configurations to benchmark, in the same format as sweep.py specs)
+        --baseline (json file of the baseline measurements to compare against)
+        --save (record the measurements as the new baseline instead of comparing)
+        --threshold (fraction a configuration can be slower, or use more memory, than its baseline before it is flagged)
+        --repeat (runs of each configuration; the fastest wall time is kept)
+        --only (only benchmark configurations whose name contains this string)
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import simulator
+import sweep
+import utils
+
+logger = logging.getLogger(__name__)
+
+RESULTS_PATH = "results/benchmark.json"
+
+parser = ArgumentParser(description="Benchmarks the simulator and flags performance regressions")
+parser.add_argument('--suite',
+                    type=str,
+                    help="Json file describing the configurations to benchmark",
+                    default="benchmarks/suite.json"
+)
+parser.add_argument('--baseline',
+                    type=str,
+                    help="Json file of baseline measurements",
+                    default="benchmarks/baseline.json"
+)
+parser.add_argument('--save',
+                    action='store_true',
+                    help="Record the measurements as the new baseline"
+)
+parser.add_argument('--threshold',
+                    type=float,
+                    help="Fraction a configuration can be slower (or use more memory) than its baseline before it is flagged",
+                    default=0.25
+)
+parser.add_argument('--min-seconds',
+                    type=float,
+                    help="Slowdowns shorter than this many seconds are noise and never flagged",
+                    default=0.05
+)
+parser.add_argument('--repeat',
+                    type=int,
+                    help="Number of runs of each configuration, keeping the fastest",
+                    default=1
+)
+parser.add_argument('--only',
+                    type=str,
+                    help="Only benchmark configurations whose name contains this string",
+                    default=None
+)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def measure(args):
+    """
+    Runs one configuration to completion and returns how fast it ran.  Meant to run in its own process
+    """
+    logging.disable(logging.INFO)
+    net = simulator.create_network(args)
+    start = time.perf_counter()
+    summary = net.run()
+    wall = time.perf_counter() - start
+    # every event that was pushed and isn't still waiting was processed
+    events = net.events.seq - len(net.events)
+    return {
+        "wall_seconds": wall,
+        "events": events,
+        "events_per_second": events / wall if wall else 0,
+        "simulated_ms_per_second": net.time / wall if wall else 0,
+        "peak_rss_mb": peak_rss_mb(),
+        # the simulated results, so that a change that should only make the simulator faster can be checked to
+        # give identical results
+        "results": hashlib.sha256(json.dumps(summary, sort_keys=True).encode()).hexdigest()[:16],
+    }
+
+
+def run_suite(configs, repeat):
+    """
+    Measures every configuration one at a time, each run in a fresh process.  Returns the measurements by name
+    """
+    measurements = {}
+    context = multiprocessing.get_context("spawn")
+    for name, args in configs:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(measure, args).result())
+        best = min(runs, key=lambda run: run["wall_seconds"])
+        best["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+        measurements[name] = best
+        logger.info(f"{name}: {best['wall_seconds']:.2f}s, {best['events_per_second']:.0f} events/s, {best['peak_rss_mb']:.0f} MB")
+    return measurements
+
+
+def compare(measurements, baseline, threshold, min_seconds):
+    """
+    Returns the regressions of the measurements against the baseline, and the configurations whose simulated
+    results changed
+    """
+    regressions = []
+    changed = []
+    for name, now in measurements.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        slower = now["wall_seconds"] - before["wall_seconds"]
+        if slower > threshold * before["wall_seconds"] and slower > min_seconds:
+            regressions.append(f"{name}: {now['wall_seconds']:.2f}s, was {before['wall_seconds']:.2f}s")
+        if now["peak_rss_mb"] > (1 + threshold) * before["peak_rss_mb"]:
+            regressions.append(f"{name}: {now['peak_rss_mb']:.0f} MB peak memory, was {before['peak_rss_mb']:.0f} MB")
+        if now["results"] != before["results"]:
+            changed.append(name)
+    return regressions, changed
+
+
+def main():
+    args = parser.parse_args()
+    simulator.configure_logging("info")
+    with open(args.suite) as f:
+        suite = json.load(f)
+    configs = [(name, config) for name, config in sweep.expand(suite) if args.only is None or args.only in name]
+    measurements = run_suite(configs, args.repeat)
+
+    utils.mkdir_if_not_exists("results")
+    with open(RESULTS_PATH, 'w') as f:
+        json.dump(measurements, f, indent=2)
+    if args.save:
+        # configurations that weren't run this time keep their old baseline
+        baseline = {}
+        if args.only and os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(measurements)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        logger.info(f"Saved the baseline of {len(measurements)} configurations to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions, changed = compare(measurements, baseline, args.threshold, args.min_seconds)
+    for name in changed:
+        logger.warning(f"{name}: simulated results differ from the baseline")
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    if regressions:
+        return 1
+    logger.info(f"No regressions beyond {args.threshold:.0%} in {len(measurements)} configurations")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,33 @@
 """
-Represents one block (in our simulator, it stores one transaction) that is the building block of the
+Represents one block (in our simulator, it stores a batch of transactions) that is the building block of the
 Blockchain
 """
-import random
+from proof_of_work import digest
 
 class Block:
-    def __init__(self, block_id, data, timestamp, previous_hash=None):
+    # blocks are created for every mined block and every mining attempt, so they don't carry a __dict__
+    __slots__ = ("block_id", "data", "nonce", "block_hash", "previous_hash", "timestamp", "index")
+
+    def __init__(self, block_id, data, timestamp, previous_hash=None, nonce=0):
         self.block_id = block_id
-        self.data = data
-        self.nonce = random.randint(0, 100000000) # assign some inital random nonce value
+        self.data = data # tuple of the transactions in the block
+        self.nonce = nonce # inital nonce value, which the ledger picks at random
         self.block_hash = None
         self.previous_hash = previous_hash
-        self.next_hash = None
-        self.next_block = None
         self.timestamp = timestamp
+        self.index = None # row of the block in the shared block table, once it is finished
     
+    def header(self):
+        """
+        Bytes of every field covered by the hash except for the nonce
+        """
+        return f"{str(self.block_id)}|{','.join(self.data)}|{str(self.timestamp)}|{str(self.previous_hash)}|".encode()
+
     def hash(self):
         """
         Calculate the hash of the block
         """
-        res = f"{str(self.block_id)}{str(self.data)}{str(self.nonce)}{str(self.timestamp)}"
-        return hash(res)
+        return digest(self.header(), self.nonce)
     
     def assign_nonce(self, value):
         """
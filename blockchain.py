@@ -1,28 +1,69 @@
-import time
+import numpy as np
 
 from block import Block
+from blocktable import Bitset, BlockTable, grow
+from constants import BLOCK_SIZE, DIFFICULTY, HASH_RATE
+from mempool import Mempool
+from proof_of_work import search_nonce, target_for
 
 
 class Blockchain:
     """
-    Data structure that stores the chain of blocks and performs computations to add new blocks and perform the proof of work
+    Data structure that stores the chain of blocks and performs computations to add new blocks and perform the proof of work.
+    The chain is an array of rows of a block table shared by every node, and confirmed transactions are a bitset of
+    their ids in that table.  Every valid block the node has received is kept in a block tree, and the chain follows
+    the longest branch of the tree
     """
-    def __init__(self, genesis_block):
-        # initialize the genesis block
-        self.genesis_block = genesis_block
-        self.genesis_block.assign_hash()
-        self.most_recent_block = self.genesis_block
-        self.unconfirmed_txns = []
-        self.previous_data = set([genesis_block.data])
-        self.current_nonce = 0
+    def __init__(self, genesis_block, difficulty=DIFFICULTY, hash_rate=HASH_RATE, mempool_capacity=None, rng=None, block_size=BLOCK_SIZE, block_bytes=None, block_wait=0, table=None):
+        self.table = table if table is not None else BlockTable()
+        # initialize the genesis block, once for every chain sharing the table
+        if self.table.size == 0:
+            genesis_block.assign_hash()
+            self.table.add(genesis_block)
+        self.chain = np.zeros(64, dtype=np.int32) # rows of the table of every block in the chain
+        self.chain[0] = genesis_block.index
+        self.length = 1
+        self.known = Bitset() # rows of every block in this node's block tree
+        self.known.add(genesis_block.index)
+        self.orphans = {} # maps from the row of a missing parent block to the blocks waiting on it
+        self.reorgs = 0 # number of times the chain switched to another branch
+        self.max_reorg_depth = 0 # most blocks dropped from the chain by one switch
+        self.unconfirmed_txns = Mempool(mempool_capacity)
+        self.confirmed = Bitset() # ids of every transaction in the chain
+        self.arrived = np.full(64, -1, dtype=np.int64) # maps from transaction id to the time it first reached this node, or -1
+        for txn in genesis_block.data:
+            self.confirmed.add(self.table.txn_id(txn))
+        self.block_size = block_size # most transactions in one block
+        self.block_bytes = block_bytes # most bytes of transactions in one block, or None for no limit
+        self.block_wait = block_wait # longest a transaction waits (in ms) for a block to fill up before it is mined anyway
         self.current_num_computations = 0
-    
-    def _same_hash(self, last_block, new_block):
+        self.target = target_for(difficulty)
+        self.hash_rate = hash_rate # number of nonces this node tries per millisecond
+        self.candidate = None # block currently being mined
+        self.candidate_start = None # time mining started on the candidate block
+        self.candidate_tries = 0 # number of hashes it takes to solve the candidate block
+        self.solve_time = None # time at which the candidate block will be solved
+        self.tracker = None # counts the nodes that have each transaction in their chain
+        self.rng = rng if rng is not None else np.random.default_rng() # picks the initial nonce of new blocks
+
+    def track(self, tracker):
+        """
+        Reports the transactions of every block added to or dropped from this chain to the given confirmation
+        tracker
+        """
+        self.tracker = tracker
+
+    def tip_height(self):
+        """
+        Block id of the most recent block in the chain
+        """
+        return int(self.table.height[self.chain[self.length - 1]])
+
+    def tip_hash(self):
         """
-        confirms that the new block correclty assigned their previous hash to be the hash of the block
-        preceding it
+        Hash of the most recent block in the chain
         """
-        return last_block.block_hash == new_block.previous_hash
+        return self.table.block_hash(self.chain[self.length - 1])
     
     def _validate_proof(self, block):
         """
@@ -32,123 +73,273 @@ class Blockchain:
 
     def add_block(self, block):
         """
-        Adds a new block to the blockchain
+        Adds a new block to the block tree, and switches the chain over to its branch if that branch is now the
+        longest.  A block whose parent hasn't arrived yet waits in the orphan pool until it does
         """
+        row = block.index
         # we have already processes this block so we can ignore the incoming request
-        if block.block_id <= self.most_recent_block.block_id:
+        if self.has_block(row):
             return True
-        # the new block doesn't pass the validation 
-        if not self._same_hash(self.most_recent_block, block) or not self._validate_proof(block):
+        # the new block doesn't pass the validation, or doesn't build on any block
+        parent = int(self.table.parent[row])
+        if parent < 0 or not self._validate_proof(block):
             return False
-        # assigning the new block to the chain and updating pointers
-        self.most_recent_block.next_hash = block.hash
-        self.most_recent_block.next_block = block
-        self.most_recent_block = block
-        self.previous_data.add(block.data)
+        if parent not in self.known:
+            self.orphans.setdefault(parent, []).append(block)
+            return True
+        best = self._connect(row)
+        # ties keep the branch that was seen first
+        if self.table.height[best] > self.tip_height():
+            self._switch_to(best)
         return True
+
+    def has_block(self, row):
+        """
+        Whether the block at the given row of the table is in this node's block tree, or waiting in its orphan pool
+        """
+        if row in self.known:
+            return True
+        return any(orphan.index == row for orphan in self.orphans.get(int(self.table.parent[row]), ()))
+
+    def has_txn(self, txn):
+        """
+        Whether the transaction is on this node's chain or waiting in its mempool
+        """
+        return self.table.txn_id(txn) in self.confirmed or self.unconfirmed_txns.holds(txn)
+
+    def _connect(self, row):
+        """
+        Adds a block to the block tree along with every orphan that descends from it, and returns the row of the
+        highest of those blocks
+        """
+        best = row
+        stack = [row]
+        while stack:
+            row = stack.pop()
+            if row in self.known:
+                continue
+            self.known.add(row)
+            if self.table.height[row] > self.table.height[best]:
+                best = row
+            stack.extend(orphan.index for orphan in self.orphans.pop(row, ()))
+        return best
+
+    def _on_chain(self, row):
+        height = self.table.height[row]
+        return height < self.length and self.chain[height] == row
+
+    def _switch_to(self, row):
+        """
+        Makes the block at the given row the tip of the chain.  Only the blocks after the point where its branch
+        leaves the chain are touched: their transactions go back into the mempool, and the transactions of the
+        new branch are confirmed
+        """
+        branch = []
+        while not self._on_chain(row):
+            branch.append(row)
+            row = int(self.table.parent[row])
+        fork_height = int(self.table.height[row])
+        depth = self.length - 1 - fork_height
+        if depth > 0:
+            self.reorgs += 1
+            self.max_reorg_depth = max(self.max_reorg_depth, depth)
+        for old in self.chain[fork_height + 1:self.length][::-1].tolist():
+            self._unconfirm(old)
+        if depth > 0:
+            self.unconfirmed_txns.reorder()
+        self.length = fork_height + 1
+        for new in reversed(branch):
+            self._append_row(new)
     
     def add_block_centralized(self, block):
         """
         For the centralized architecture, accept a block and don't do any verfication since the 
         centralized server is trusted
         """
-        if block.data in self.previous_data:
+        # the block is known either way, so that gossip doesn't relay it again
+        self.known.add(block.index)
+        if all(i in self.confirmed for i in self.table.txn_ids_of(block.index)):
             return True
-        self.most_recent_block.next_block = block
-        self.most_recent_block = block
-        self.previous_data.add(block.data)
+        self._append_row(block.index)
         return True
 
-    def add_incoming_txn(self, block):
+    def _append_row(self, row):
+        """
+        Adds a block from the table to the end of the chain and marks its transactions as confirmed
+        """
+        self.chain = grow(self.chain, self.length + 1)
+        self.chain[self.length] = row
+        self.length += 1
+        txn_ids = self.table.txn_ids_of(row)
+        for i in txn_ids:
+            self.confirmed.add(i)
+            self.unconfirmed_txns.remove(self.table.txns[i])
+        if self.tracker is not None:
+            self.tracker.confirm(txn_ids)
+
+    def _unconfirm(self, row):
+        """
+        Returns the transactions of a block that left the chain to the mempool, with the time they first arrived
+        """
+        txn_ids = self.table.txn_ids_of(row)
+        for i in txn_ids:
+            self.confirmed.discard(i)
+            # transactions the node only saw in blocks count as arriving with the block
+            arrived = int(self.arrived[i]) if i < len(self.arrived) else -1
+            self.unconfirmed_txns.add(self.table.txns[i], arrived if arrived >= 0 else int(self.table.timestamp[row]))
+        if self.tracker is not None:
+            self.tracker.unconfirm(txn_ids)
+
+    def add_incoming_txn(self, txn, timestamp=0):
+        """
+        Place a new transaction that arrived at the given time into this Chain's uncofirmed transactions, unless it
+        has already been added to the chain
+        """
+        i = self.table.txn_id(txn)
+        self.arrived = grow(self.arrived, i + 1, -1)
+        if self.arrived[i] < 0:
+            self.arrived[i] = timestamp
+        if i in self.confirmed:
+            return
+        self.unconfirmed_txns.add(txn, timestamp)
+
+    def _next_batch(self):
+        """
+        Returns the transactions of the next block and the earliest time it can be made: right away once the block
+        is full, otherwise once its oldest transaction has waited block_wait ms.  Returns (None, None) if there is
+        nothing to mine
+        """
+        txns, full = self.unconfirmed_txns.batch(self.block_size, self.block_bytes)
+        if not txns:
+            return None, None
+        if full:
+            return tuple(txns), 0
+        return tuple(txns), self.unconfirmed_txns.arrival(txns[0]) + self.block_wait
+
+    def batch_ready_time(self, timestamp):
         """
-        Place a new block into this Chain's uncofirmed transactions
+        Earliest time from the given time on at which the next block can be made, or None if there is nothing to mine
         """
-        self.unconfirmed_txns.append(block)
+        _, ready = self._next_batch()
+        if ready is None:
+            return None
+        return max(ready, timestamp)
+
+    def next_batch(self, timestamp):
+        """
+        Returns the transactions of the next block if it can be made at the given time, otherwise None
+        """
+        txns, ready = self._next_batch()
+        if txns is None or ready > timestamp:
+            return None
+        return txns
 
     def proof_of_work(self, block):
         """
-        Apply the proof of work computation by updating the nonce value and checking if the hash of the block
-        is divisible by 600
+        Apply the proof of work computation by trying nonces, starting from the block's initial nonce, until the
+        hash of the block falls under the difficulty target.  Returns the number of hashes it took
+        """
+        nonce, _, tries = search_nonce(block.header(), block.nonce, self.target)
+        block.assign_nonce(nonce)
+        block.assign_hash()
+        return tries
+
+    def _initial_nonce(self):
+        """
+        Assign some inital random nonce value to a new block
         """
-        self.current_nonce += 1
-        self.current_num_computations += 1
-        block.assign_nonce(self.current_nonce)
-        h = block.hash()
-        if h % 600 == 0:
-            block.assign_hash()
-            num_computations = self.current_num_computations
-            self.current_num_computations = 0
-            return h, num_computations
-        return None, -1
+        return int(self.rng.integers(0, 100000000, endpoint=True))
 
-    def process_txn(self, pkt):
+    def process_txns(self, timestamp):
         """
-        For the centralized architecture, immediatley create a new block without mining the block
+        For the centralized architecture, create a new block from the waiting transactions without mining the block,
+        or return None if the next block isn't ready yet
         """
-        prev_block = self.most_recent_block
-        next_block_id = prev_block.block_id + 1
-        new_block = Block(block_id=next_block_id, data=pkt, timestamp=time.time())
+        txns = self.next_batch(timestamp)
+        if txns is None:
+            return None
+        next_block_id = self.tip_height() + 1
+        new_block = Block(block_id=next_block_id, data=txns, timestamp=timestamp, previous_hash=self.tip_hash(), nonce=self._initial_nonce())
+        new_block.assign_hash()
+        self.table.add(new_block)
         return new_block
 
-    def mine_pos(self):
+    def mine_pos(self, timestamp):
         """
         POS mining doesn't require computationally heavy methods to find nonce
         """
-        # no incoming transactions to mine
-        if not self.unconfirmed_txns:
+        # transactions that have already been mined were dropped from the mempool
+        next_block_data = self.next_batch(timestamp)
+        # no incoming transactions to mine, or still waiting for the block to fill up
+        if next_block_data is None:
             return None
-        prev_block = self.most_recent_block
-        next_block_id = prev_block.block_id + 1
-        next_block_data = self.unconfirmed_txns[0]
-        # stop working on mining a block if it has already been mined
-        while next_block_data in self.previous_data:
-            self.unconfirmed_txns.pop(0)
-            if len(self.unconfirmed_txns) == 0:
-                return None
-            next_block_data = self.unconfirmed_txns[0]
+        next_block_id = self.tip_height() + 1
         # new block
-        next_block = Block(block_id=next_block_id, data=next_block_data, timestamp=time.time(), previous_hash=prev_block.block_hash)
+        next_block = Block(block_id=next_block_id, data=next_block_data, timestamp=timestamp, previous_hash=self.tip_hash(), nonce=self._initial_nonce())
         next_block.assign_hash()
-        proof = next_block.hash()
+        self.table.add(next_block)
         num_computations = 1
 
-        # successfully found the nonce 
-        if next_block.data not in self.previous_data:
-            # add to current Blockchain the newly mined block
-            self.add_block(next_block)
-        # remove the transaction from the list since we solved it
-        self.unconfirmed_txns.pop(0)
+        # add to current Blockchain the newly mined block, which removes its transactions from the mempool
+        self.add_block(next_block)
         return next_block, num_computations
 
-    def mine(self):
+    def _abandon_candidate(self, timestamp):
+        """
+        Stops mining the candidate block, counting the hashes computed on it so far
+        """
+        if self.candidate is None:
+            return
+        self.current_num_computations += min(self.candidate_tries, (timestamp - self.candidate_start) * self.hash_rate)
+        self.candidate = None
+        self.solve_time = None
+
+    def next_attempt(self, timestamp):
+        """
+        Returns the next time at which mining can make progress
+        """
+        if self.solve_time is not None and self.solve_time > timestamp:
+            return self.solve_time
+        # waiting for the next block to fill up
+        if self.candidate is None:
+            ready = self.batch_ready_time(timestamp)
+            if ready is not None and ready > timestamp:
+                return ready
+        return timestamp + 1
+
+    def mine(self, timestamp):
         """
         Perform the mining computation of working on an incoming transaction, finding the nonce, and calcuating the proof
-        if the nonce value solves the problem.
+        if the nonce value solves the problem.  The node tries hash_rate nonces every millisecond, so the candidate block
+        is solved once enough time has passed to compute all of the hashes needed to find the nonce
         """
-        # no incoming transactions to mine
-        if not self.unconfirmed_txns:
-            return None
-        prev_block = self.most_recent_block
-        next_block_id = prev_block.block_id + 1
-        next_block_data = self.unconfirmed_txns[0]
-        # stop working on mining a block if it has already been mined
-        while next_block_data in self.previous_data:
-            self.unconfirmed_txns.pop(0)
-            if len(self.unconfirmed_txns) == 0:
+        prev_hash = self.tip_hash()
+        # the candidate is stale once another block confirmed any of its transactions
+        stale = self.candidate is not None and (self.candidate.previous_hash != prev_hash or any(txn not in self.unconfirmed_txns for txn in self.candidate.data))
+        if self.candidate is None or stale:
+            self._abandon_candidate(timestamp)
+            next_block_data = self.next_batch(timestamp)
+            # no incoming transactions to mine, or still waiting for the block to fill up
+            if next_block_data is None:
                 return None
-            next_block_data = self.unconfirmed_txns[0]
-        # new block
-        next_block = Block(block_id=next_block_id, data=next_block_data, timestamp=time.time(), previous_hash=prev_block.block_hash)
-        # calculate nonce and hash value
-        proof, num_computations = self.proof_of_work(next_block)
-        # haven't found the correct nonce this round
-        if proof is None:
+            # new block
+            self.candidate = Block(block_id=self.tip_height() + 1, data=next_block_data, timestamp=timestamp, previous_hash=prev_hash, nonce=self._initial_nonce())
+            self.candidate_start = timestamp
+            # calculate nonce and hash value
+            self.candidate_tries = self.proof_of_work(self.candidate)
+            self.solve_time = timestamp + (self.candidate_tries - 1) // self.hash_rate
+
+        # haven't computed enough hashes to reach the correct nonce yet
+        if timestamp < self.solve_time:
             return None
 
-        # successfully found the nonce 
-        if next_block.data not in self.previous_data:
-            # add to current Blockchain the newly mined block
-            self.add_block(next_block)
-        # remove the transaction from the list since we solved it
-        self.unconfirmed_txns.pop(0)
-        return next_block, num_computations
\ No newline at end of file
+        # successfully found the nonce
+        next_block = self.candidate
+        num_computations = self.current_num_computations + self.candidate_tries
+        self.current_num_computations = 0
+        self.candidate = None
+        self.solve_time = None
+        self.table.add(next_block)
+        # add to current Blockchain the newly mined block, which removes its transactions from the mempool
+        self.add_block(next_block)
+        return next_block, num_computations
@@ -0,0 +1,110 @@
+"""
+Storage shared by every node in a network: one table of every block that has been made, and interned ids for every
+transaction.  Each node's chain is an array of rows of the table and the transactions it has confirmed are a bitset
+over the transaction ids, so a node only pays a few bytes per block instead of a linked list of objects
+"""
+import numpy as np
+
+NO_PARENT = -1
+
+
+def grow(array, size, fill=0):
+    """
+    Returns the array, or a copy at least twice as long, so that it can hold size entries
+    """
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class BlockTable:
+    """
+    Append-only columns describing every block that has been made: its height (block id), the row of its parent,
+    its hash, its timestamp and its transactions, stored as a slice of txn_refs.  Rows never change once added
+    """
+    def __init__(self, capacity=1024):
+        self.size = 0 # number of blocks in the table
+        self.height = np.zeros(capacity, dtype=np.int64)
+        self.parent = np.full(capacity, NO_PARENT, dtype=np.int64)
+        self.hash = np.zeros(capacity, dtype=np.uint64)
+        self.timestamp = np.zeros(capacity, dtype=np.int64)
+        self.txn_start = np.zeros(capacity, dtype=np.int64) # first entry of each block in txn_refs
+        self.txn_count = np.zeros(capacity, dtype=np.int64)
+        self.txn_refs = np.zeros(capacity, dtype=np.int64) # transaction ids of every block, one block after another
+        self.num_refs = 0
+        self.rows = {} # maps from block hash to its row
+        self.txn_ids = {} # maps from transaction to its id
+        self.txns = [] # maps from transaction id to the transaction
+
+    def txn_id(self, txn):
+        """
+        Returns the id of the transaction, giving it the next free id the first time it is seen
+        """
+        i = self.txn_ids.get(txn)
+        if i is None:
+            i = len(self.txns)
+            self.txn_ids[txn] = i
+            self.txns.append(txn)
+        return i
+
+    def add(self, block):
+        """
+        Adds a finished block to the table and stores its row on the block
+        """
+        row = self.size
+        count = len(block.data)
+        self.size += 1
+        self.height = grow(self.height, self.size)
+        self.parent = grow(self.parent, self.size, NO_PARENT)
+        self.hash = grow(self.hash, self.size)
+        self.timestamp = grow(self.timestamp, self.size)
+        self.txn_start = grow(self.txn_start, self.size)
+        self.txn_count = grow(self.txn_count, self.size)
+        self.txn_refs = grow(self.txn_refs, self.num_refs + count)
+
+        self.height[row] = block.block_id
+        self.parent[row] = self.rows.get(block.previous_hash, NO_PARENT)
+        self.hash[row] = block.block_hash
+        self.timestamp[row] = block.timestamp
+        self.txn_start[row] = self.num_refs
+        self.txn_count[row] = count
+        self.txn_refs[self.num_refs:self.num_refs + count] = [self.txn_id(txn) for txn in block.data]
+        self.num_refs += count
+        self.rows[block.block_hash] = row
+        block.index = row
+        return row
+
+    def block_hash(self, row):
+        return int(self.hash[row])
+
+    def txn_ids_of(self, row):
+        """
+        Ids of the transactions in the block at the given row
+        """
+        start = self.txn_start[row]
+        return self.txn_refs[start:start + self.txn_count[row]].tolist()
+
+
+class Bitset:
+    """
+    Set of non-negative integers stored as one bit each
+    """
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, i):
+        byte = i >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        self.bits[byte] |= 1 << (i & 7)
+
+    def discard(self, i):
+        byte = i >> 3
+        if byte < len(self.bits):
+            self.bits[byte] &= ~(1 << (i & 7)) & 0xff
+
+    def __contains__(self, i):
+        byte = i >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] >> (i & 7) & 1)
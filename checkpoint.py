@@ -0,0 +1,53 @@
+"""
+Periodic snapshots of a running simulation, so that a long run that dies can continue from where it left off
+"""
+import gzip
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpointer:
+    """
+    Writes a compressed snapshot of the whole network (time, mailboxes, ledgers, mempools, latency and consensus
+    bookkeeping, random number streams) every `interval` simulated ms and/or every `wall_interval` seconds
+    """
+    def __init__(self, path, interval=None, wall_interval=None):
+        self.path = path
+        self.interval = interval
+        self.wall_interval = wall_interval
+        self.last_time = None # simulated time of the last snapshot
+        self.last_wall_time = time.time()
+
+    def due(self, sim_time):
+        """
+        Checks if a snapshot should be taken at the given simulated time
+        """
+        if self.interval is not None and (self.last_time is None or sim_time - self.last_time >= self.interval):
+            return True
+        if self.wall_interval is not None and time.time() - self.last_wall_time >= self.wall_interval:
+            return True
+        return False
+
+    def save(self, net):
+        """
+        Writes a snapshot of the network, replacing the previous one only once the new one is complete
+        """
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, 'wb') as f:
+            pickle.dump(net, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.last_time = net.time
+        self.last_wall_time = time.time()
+        logger.debug(f"Wrote a snapshot at time {net.time} to {self.path}")
+
+
+def load(path):
+    """
+    Reads the network from a snapshot
+    """
+    with gzip.open(path, 'rb') as f:
+        return pickle.load(f)
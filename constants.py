@@ -3,4 +3,16 @@ Stores all constants used in this project
 """
 
 BLOCK = 'BLK'
-TRANSACTION = 'TXN'
\ No newline at end of file
+TRANSACTION = 'TXN'
+
+# kinds of events processed by the network, in the order they are handled within one time step
+ACTION = 0
+DELIVERY = 1
+MINE = 2
+
+# proof of work defaults: expected number of hashes to mine a block, and hashes each node computes per millisecond
+DIFFICULTY = 600
+HASH_RATE = 1
+
+# most transactions in one block by default
+BLOCK_SIZE = 1
@@ -0,0 +1,187 @@
+"""
+Append-only log of what happens during a simulation.  Events are buffered in memory and written out in chunks,
+either as JSON lines or as columnar NumPy chunks, so a run never has to hold its full history in memory
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+# kinds of events and the names of the values each one carries
+SUBMITTED = 0 # a transaction entered the network: transaction index, sending node
+MAJORITY = 1 # a majority of nodes agree on a transaction: transaction index, latency since submission
+CONSENSUS = 2 # all nodes agree on a transaction: transaction index, latency since submission
+MINED = 3 # a node produced a block: node, block id, computations it took
+SENT = 4 # a node sent a packet to other nodes: sending node, number of packets, packet type
+MEMPOOL = 5 # periodic sample of the mempools: transactions waiting across all nodes, largest mempool
+NAMES = ["submitted", "majority", "consensus", "mined", "sent", "mempool"]
+FIELDS = [("txn", "sender"), ("txn", "latency"), ("txn", "latency"), ("node", "block", "computations"), ("sender", "packets", "packet_type"), ("total", "largest")]
+NUM_VALUES = 3 # most values carried by one event
+
+# packet types in SENT events
+BLOCK_PACKET = 0
+TRANSACTION_PACKET = 1
+
+
+class NullSink:
+    """
+    Drops every event
+    """
+    def write(self, kind, time, *values):
+        pass
+
+    def flush(self):
+        pass
+
+    def position(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    """
+    Writes one JSON object per event to a file, buffering events between writes
+    """
+    def __init__(self, path, buffer_size=4096, position=None):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        # drop anything written after the given position, so a resumed run doesn't repeat events
+        if position is not None and os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(position)
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+
+    def write(self, kind, time, *values):
+        event = {"event": NAMES[kind], "time": int(time)}
+        for name, value in zip(FIELDS[kind], values):
+            event[name] = int(value)
+        self.buffer.append(json.dumps(event))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self.file.flush()
+
+    def position(self):
+        """
+        Size of the log once everything buffered has been written
+        """
+        self.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class NpySink:
+    """
+    Writes events as int64 rows of (kind, time, values...) into numbered .npy chunks in a directory
+    """
+    def __init__(self, directory, buffer_size=65536, position=None):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.buffer = []
+        os.makedirs(directory, exist_ok=True)
+        # drop any chunks written after the given position, so a resumed run doesn't repeat events
+        for path in glob.glob(os.path.join(directory, "events-*.npy")):
+            if position is None or chunk_index(path) >= position:
+                os.remove(path)
+        self.chunks = position if position is not None else 0
+
+    def write(self, kind, time, *values):
+        row = [kind, time, *values]
+        row += [0] * (NUM_VALUES + 2 - len(row))
+        self.buffer.append(row)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        np.save(os.path.join(self.directory, f"events-{self.chunks:06d}.npy"), np.array(self.buffer, dtype=np.int64))
+        self.chunks += 1
+        self.buffer = []
+
+    def position(self):
+        """
+        Number of chunks once everything buffered has been written
+        """
+        self.flush()
+        return self.chunks
+
+    def close(self):
+        self.flush()
+
+
+def chunk_index(path):
+    return int(os.path.basename(path)[len("events-"):-len(".npy")])
+
+
+def open_sink(fmt, directory, position=None):
+    """
+    Creates the sink for the given format (jsonl, npy or none) that writes into the given results directory.  A new
+    log (one that isn't resumed from a position) first removes the logs an earlier run left in the other formats
+    """
+    if position is None:
+        remove_logs(directory, keep=fmt)
+    if fmt == "jsonl":
+        return JsonlSink(os.path.join(directory, "events.jsonl"), position=position)
+    if fmt == "npy":
+        return NpySink(os.path.join(directory, "events"), position=position)
+    if fmt == "none":
+        return NullSink()
+    raise Exception(f"Invalid log format: {fmt} does not exist!  Try using 'jsonl', 'npy' or 'none'")
+
+
+def remove_logs(directory, keep=None):
+    """
+    Removes the event logs in the given results directory, other than the one in the keep format, so that
+    read_events can't read back a log from an earlier run
+    """
+    jsonl_path = os.path.join(directory, "events.jsonl")
+    if keep != "jsonl" and os.path.exists(jsonl_path):
+        os.remove(jsonl_path)
+    if keep != "npy":
+        for path in glob.glob(os.path.join(directory, "events", "events-*.npy")):
+            os.remove(path)
+
+
+def read_events(directory):
+    """
+    Reads back the events logged in a results directory in either format, as (kind, time, values) tuples
+    """
+    jsonl_path = os.path.join(directory, "events.jsonl")
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path) as f:
+            for line in f:
+                event = json.loads(line)
+                kind = NAMES.index(event["event"])
+                yield kind, event["time"], tuple(event[name] for name in FIELDS[kind])
+        return
+    for path in sorted(glob.glob(os.path.join(directory, "events", "events-*.npy"))):
+        for row in np.load(path).tolist():
+            kind = row[0]
+            yield kind, row[1], tuple(row[2:2 + len(FIELDS[kind])])
+
+
+def read_latencies(directory, kind=MAJORITY):
+    """
+    Returns lists of (submission times, latencies) of every transaction from the majority or consensus events of a run
+    """
+    start_times = []
+    latencies = []
+    for event_kind, time, values in read_events(directory):
+        if event_kind == kind:
+            start_times.append(time - values[1])
+            latencies.append(values[1])
+    return start_times, latencies
@@ -0,0 +1,40 @@
+"""
+Priority queue of timestamped events that drives the simulation.  Instead of advancing the network one
+millisecond at a time, the network jumps straight to the time of the next pending event
+"""
+import heapq
+
+
+class EventQueue:
+    """
+    Min-heap of (time, kind, node id) events.  Events at the same time are ordered by their kind (actions, then
+    deliveries, then mining) and then by node id, which matches the order a full tick over every node would use
+    """
+    def __init__(self):
+        self.heap = []
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, time, kind, node_id=-1):
+        """
+        Schedules a new event of the given kind at the given time
+        """
+        heapq.heappush(self.heap, (time, kind, node_id, self.seq))
+        self.seq += 1
+
+    def peek_time(self):
+        """
+        Returns the time of the next event, or None if there are no pending events
+        """
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop(self):
+        """
+        Removes and returns the next event as (time, kind, node id)
+        """
+        time, kind, node_id, _ = heapq.heappop(self.heap)
+        return time, kind, node_id
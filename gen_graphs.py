@@ -1,12 +1,23 @@
-import numpy as np
+"""
+Generates graphs from the results of experiments.  Metrics of every run are cached in an index of the results
+directory keyed by file modification time and size, and a figure is only re-rendered when its inputs changed.
+Figures are rendered in parallel, each in its own process with the Agg backend.  Runs merged from replicates
+(simulator.py --replicates) get error bars of the 95% confidence intervals of their metrics.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import hashlib
 import json
+import logging
 import os
 import sys
-import argparse
-import matplotlib as mpl
+
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 sys.path.append('./')
 import utils
+from eventlog import read_latencies
 
 from argparse import ArgumentParser
 parser = ArgumentParser(description="Script to generate graph")
@@ -31,151 +42,238 @@ parser.add_argument('--name',
                     type=str,
                     help="Name of current experiment",
 )
-args = parser.parse_args()
+parser.add_argument('--workers',
+                    type=int,
+                    help="Number of processes to render figures in",
+                    default=os.cpu_count()
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = "results/.index.json" # cached metrics of every results.json
+RENDERED_PATH = "graphs/.rendered.json" # fingerprint of the inputs of every rendered figure
+LABELS = {"c": "Centralized", "pow": "Proof of Work", "pos": "Proof of Stake"}
+NODES = [3, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+def file_key(path):
+    """
+    Cheap identifier of a version of a file
+    """
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def log_key(run_dir):
+    """
+    Identifier of the version of a run's event log, in whichever format it was written
+    """
+    paths = [os.path.join(run_dir, "events.jsonl")] + sorted(glob.glob(os.path.join(run_dir, "events", "events-*.npy")))
+    return [[path, file_key(path)] for path in paths if os.path.exists(path)]
+
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    utils.mkdir_if_not_exists(os.path.dirname(path))
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def build_index():
+    """
+    Returns the metrics of every run in the results directory, only re-reading results.json files that changed
+    since the index was last built.  Runs whose results are missing a metric (unfinished runs, or runs from older
+    versions of the simulator) are left out with a warning
+    """
+    index = load_json(INDEX_PATH, {})
+    fresh = {}
+    for path in glob.glob("results/*/results.json"):
+        run = os.path.basename(os.path.dirname(path))
+        key = file_key(path)
+        if run in index and index[run]["key"] == key:
+            fresh[run] = index[run]
+            continue
+        results = load_json(path, {})
+        names = ("num_computations", "num_packets", "average_latency")
+        metrics = results.get("metrics", {})
+        missing = [k for k in names if k not in metrics]
+        if missing:
+            logger.warning(f"Skipping {run}: its results have no {', '.join(missing)}")
+            continue
+        fresh[run] = {"key": key, "metrics": {k: metrics[k] for k in names}}
+        # runs merged from replicates also have confidence intervals, and the seeds of the replicates
+        if all(k in results.get("intervals", {}) for k in names) and "seeds" in results:
+            fresh[run]["intervals"] = {k: results["intervals"][k] for k in names}
+            fresh[run]["seeds"] = results["seeds"]
+    if fresh != index:
+        save_json(INDEX_PATH, fresh)
+    return fresh
+
 
 def average_latency(j):
-    total_lat = 0
-    for key, val in j.items():
-        if "LATENCY" in val:
-            total_lat += val["LATENCY"]
-    return total_lat / (len(j)-1)
+    return j["average_latency"]
 
 def packets(j):
-    return j["metrics"]["num_packets"]
+    return j["num_packets"]
 
 def computations(j):
-    return j["metrics"]["num_computations"]
+    return j["num_computations"]
+
+
+def error(entry, metric):
+    """
+    Distance from the mean to the ends of the 95% confidence interval of a metric as [below, above], or None if the
+    run wasn't merged from replicates
+    """
+    if "intervals" not in entry:
+        return None
+    stats = entry["intervals"][metric]
+    return [stats["mean"] - stats["ci_low"], stats["ci_high"] - stats["mean"]]
+
+
+def error_bars(errors):
+    # matplotlib takes the distances below and above every point as two rows
+    if errors is None or any(e is None for e in errors):
+        return None
+    return [[e[0] for e in errors], [e[1] for e in errors]]
 
-def save_bar_graphs(pow_data, pos_data, c_data):
-    if args.topo == "equadistant":
-        topo = "Equadistant"
-    else:
-        topo = "Wide Area"
-    pow_av = average_latency(pow_data)
-    pos_av = average_latency(pos_data)
-    c_av = average_latency(c_data)
-    data = {"Centralized" : c_av, "Proof of Work": pow_av, "Proof of Stake": pos_av}
-    plt.bar(list(data.keys()), list(data.values()), color = 'red', width = 0.4)
-    plt.xlabel("Type of Protocol")
-    plt.ylabel("Average Latency")
-    plt.title("Latency Depending on Protocol for " + topo + " Topology")
-    utils.mkdir_if_not_exists(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes")
-    plt.savefig(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes/average_latencies.png")
-    # packets
-    plt.clf()
-    data = {"Centralized" : computations(c_data), "Proof of Work": computations(pow_data), "Proof of Stake": computations(pos_data)}
-    plt.bar(list(data.keys()), list(data.values()), color = 'green', width = 0.4)
-    plt.xlabel("Type of Protocol")
-    plt.ylabel("Number of Computations")
-    plt.title("Computations Depending on Protocol for " + topo + " Topology")
-    utils.mkdir_if_not_exists(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes")
-    plt.savefig(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes/total_computations.png")
-    # packets
-    plt.clf()
-    data = {"Centralized" : packets(c_data), "Proof of Work": packets(pow_data), "Proof of Stake": packets(pos_data)}
-    plt.bar(list(data.keys()), list(data.values()), color = 'green', width = 0.4)
-    plt.xlabel("Type of Protocol")
-    plt.ylabel("Number of Packets")
-    plt.title("Packets Depending on Protocol for " + topo + " Topology")
-    utils.mkdir_if_not_exists(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes")
-    plt.savefig(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes/total_packets.png")
-    # packets / latency
-    plt.clf()
-    data = {"Centralized" : packets(c_data) / average_latency(c_data), "Proof of Work": packets(pow_data) / average_latency(pow_data), "Proof of Stake": packets(pos_data) / average_latency(pos_data)}
-    plt.bar(list(data.keys()), list(data.values()), color = 'green', width = 0.4)
-    plt.xlabel("Type of Protocol")
-    plt.ylabel("Packets / Latency")
-    plt.title("Throughput Depending on Protocol for " + topo + " Topology")
-    utils.mkdir_if_not_exists(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes")
-    plt.savefig(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes/packets_over_latency.png")
-
-
-def save_line_graph(pow_data, pos_data, c_data):
-    if args.topo == "equadistant":
-        topo = "Equadistant"
-    else:
-        topo = "Wide Area"
-    start_time_arrays = []
-    latency_arrays = []
-    for data in [pow_data, pos_data, c_data]:
-        start_times = []
-        latencies = []
-        for key, val in data.items():
-            if "LATENCY" in val:
-                start_times.append(val["start"])
-                latencies.append(val["LATENCY"])
-        start_time_arrays.append(start_times)
-        latency_arrays.append(latencies)
-    for i in range(3):
-        if i == 0:
-            label = "Proof of Work"
-        elif i == 1:
-            label = "Proof of Stake"
-        else:
-            label = "Centralized"
-        plt.plot(start_time_arrays[i], latency_arrays[i], label=label)
-        plt.legend()
-    plt.xlabel("Start Times")
-    plt.ylabel("Latency")
-    plt.title("Latencies Over Time for " + topo + " Topology")
-    plt.savefig(f"graphs/{args.name}-{args.topo}-{args.nodes}-nodes/latency_over_time.png")
-
-def save_line_graphs():
-    nodes = [3, 5, 10, 25, 50, 100, 250, 500, 1000]
-    protocols = ["c", "pos", "pow"]
-    for protocol in protocols:
-        computations_array = []
-        for node in nodes:
-            data = json.load(open(f"results/{args.name}-{protocol}-{args.topo}-{node}-nodes/results.json"))
-            computations_array.append(computations(data))
-        if protocol == "c":
-            label = "Centralized"
-        elif protocol == "pos":
-            label = "Proof of Stake"
-        else:
-            label = "Proof of Work"
-        plt.plot(nodes, computations_array, label=label)
-        plt.legend()
-    plt.xlabel("# of Nodes")
-    plt.ylabel("Computations")
-    plt.title("# of Computations Based on Nodes")
-    plt.savefig(f"graphs/computations_over_nodes.png")
-    plt.clf()
-    # packets
-    for protocol in protocols:
-        packets_array = []
-        for node in nodes:
-            data = json.load(open(f"results/{args.name}-{protocol}-{args.topo}-{node}-nodes/results.json"))
-            packets_array.append(packets(data))
-        if protocol == "c":
-            label = "Centralized"
-        elif protocol == "pos":
-            label = "Proof of Stake"
-        else:
-            label = "Proof of Work"
-        plt.plot(nodes, packets_array, label=label)
-        plt.legend()
-    plt.xlabel("# of Nodes")
-    plt.ylabel("Packets")
-    plt.title("# of Packets Based on Nodes")
-    plt.savefig(f"graphs/packets_over_nodes.png")
-    plt.clf()
+
+def render_bar(path, title, xlabel, ylabel, data, color, errors=None):
+    fig, ax = plt.subplots()
+    ax.bar(list(data.keys()), list(data.values()), color=color, width=0.4, yerr=error_bars(errors), capsize=4)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_lines(path, title, xlabel, ylabel, series):
+    fig, ax = plt.subplots()
+    for label, xs, ys, *errors in series:
+        ax.errorbar(xs, ys, yerr=error_bars(errors[0] if errors else None), label=label, capsize=3)
+    ax.legend()
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_latency_over_time(path, title, runs):
+    # per block latencies are only kept in each run's event log, so they are read by the rendering process
+    series = []
+    for label, run_dir in runs:
+        start_times, latencies = read_latencies(run_dir)
+        # transactions reach consensus out of order, so the points are put back in order of submission
+        order = sorted(range(len(start_times)), key=start_times.__getitem__)
+        series.append((label, [start_times[i] for i in order], [latencies[i] for i in order]))
+    render_lines(path, title, "Start Times", "Latency", series)
+
+
+RENDERERS = {"bar": render_bar, "lines": render_lines, "latency_over_time": render_latency_over_time}
+
+
+def render(figure):
+    """
+    Renders one figure, given as (output path, renderer name, arguments, inputs)
+    """
+    path, renderer, kwargs, _ = figure
+    RENDERERS[renderer](path, **kwargs)
+    return path
+
+
+def fingerprint(figure):
+    _, renderer, kwargs, inputs = figure
+    return hashlib.sha256(json.dumps([renderer, kwargs, inputs], sort_keys=True).encode()).hexdigest()
+
+
+def topo_title(topo):
+    if topo == "equadistant":
+        return "Equadistant"
+    return "Wide Area"
+
+
+def bar_figures(index, name, topo_key, nodes):
+    """
+    Figures comparing the protocols for one experiment
+    """
+    topo = topo_title(topo_key)
+    keys = {protocol: f"{name}-{protocol}-{topo_key}-{nodes}-nodes" for protocol in ["c", "pow", "pos"]}
+    missing = [key for key in keys.values() if key not in index]
+    if missing:
+        logger.warning(f"No figures for {name}: missing results of {', '.join(missing)}")
+        return []
+    entries = {protocol: index[key] for protocol, key in keys.items()}
+    data = {protocol: entry["metrics"] for protocol, entry in entries.items()}
+    out_dir = f"graphs/{name}-{topo_key}-{nodes}-nodes"
+    utils.mkdir_if_not_exists(out_dir)
+
+    def bar(file_name, fn, ylabel, title, color, metric=None):
+        values = {LABELS[protocol]: fn(data[protocol]) for protocol in ["c", "pow", "pos"]}
+        errors = [error(entries[protocol], metric) for protocol in ["c", "pow", "pos"]] if metric else None
+        return (f"{out_dir}/{file_name}", "bar", {"title": title, "xlabel": "Type of Protocol", "ylabel": ylabel, "data": values, "color": color, "errors": errors}, [])
+
+    def run_dir(protocol):
+        # merged replicates don't have an event log, so latencies over time are drawn from the first replicate
+        seeds = entries[protocol].get("seeds")
+        run_name = f"{name}-seed-{seeds[0]}" if seeds else name
+        return f"results/{run_name}-{protocol}-{topo_key}-{nodes}-nodes"
+
+    runs = [(LABELS[protocol], run_dir(protocol)) for protocol in ["pow", "pos", "c"]]
+    return [
+        bar("average_latencies.png", average_latency, "Average Latency", "Latency Depending on Protocol for " + topo + " Topology", 'red', "average_latency"),
+        bar("total_computations.png", computations, "Number of Computations", "Computations Depending on Protocol for " + topo + " Topology", 'green', "num_computations"),
+        bar("total_packets.png", packets, "Number of Packets", "Packets Depending on Protocol for " + topo + " Topology", 'green', "num_packets"),
+        bar("packets_over_latency.png", lambda j: packets(j) / average_latency(j), "Packets / Latency", "Throughput Depending on Protocol for " + topo + " Topology", 'green'),
+        (f"{out_dir}/latency_over_time.png", "latency_over_time", {"title": "Latencies Over Time for " + topo + " Topology", "runs": runs}, [log_key(run_dir) for _, run_dir in runs]),
+    ]
+
+
+def node_figures(index, name, topo_key):
+    """
+    Figures of how the protocols scale with the number of nodes
+    """
+    figures = []
+    for file_name, fn, metric, ylabel, title in [("computations_over_nodes.png", computations, "num_computations", "Computations", "# of Computations Based on Nodes"),
+                                                 ("packets_over_nodes.png", packets, "num_packets", "Packets", "# of Packets Based on Nodes")]:
+        series = []
+        for protocol in ["c", "pos", "pow"]:
+            # node counts without results are left out of the line
+            keys = [f"{name}-{protocol}-{topo_key}-{node}-nodes" for node in NODES]
+            nodes = [node for node, key in zip(NODES, keys) if key in index]
+            if len(nodes) < len(NODES):
+                logger.warning(f"{file_name}: no {LABELS[protocol]} results for {len(NODES) - len(nodes)} node counts")
+            entries = [index[key] for key in keys if key in index]
+            values = [fn(entry["metrics"]) for entry in entries]
+            series.append((LABELS[protocol], nodes, values, [error(entry, metric) for entry in entries]))
+        figures.append((f"graphs/{file_name}", "lines", {"title": title, "xlabel": "# of Nodes", "ylabel": ylabel, "series": series}, []))
+    return figures
 
 
 def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    index = build_index()
     if args.graph == "none":
-        pow_data = json.load(open(f"results/{args.name}-pow-{args.topo}-{args.nodes}-nodes/results.json"))
-        pos_data = json.load(open(f"results/{args.name}-pos-{args.topo}-{args.nodes}-nodes/results.json"))
-        c_data = json.load(open(f"results/{args.name}-c-{args.topo}-{args.nodes}-nodes/results.json"))
-        save_bar_graphs(pow_data, pos_data, c_data)
-        plt.clf()
-        save_line_graph(pow_data, pos_data, c_data)
+        figures = bar_figures(index, args.name, args.topo, args.nodes)
     else:
-        save_line_graphs()
+        figures = node_figures(index, args.name, args.topo)
 
+    rendered = load_json(RENDERED_PATH, {})
+    stale = [figure for figure in figures if rendered.get(figure[0]) != fingerprint(figure) or not os.path.exists(figure[0])]
+    logger.info(f"Rendering {len(stale)} of {len(figures)} figures")
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for figure, path in zip(stale, pool.map(render, stale)):
+            rendered[path] = fingerprint(figure)
+    save_json(RENDERED_PATH, rendered)
 
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,72 @@
+"""
+Gossip relay: broadcasts travel along a random peer graph instead of going from the origin straight to every node.
+Each node forwards a message it hasn't seen before to its peers, and drops duplicates using a bounded cache of the
+messages it has seen backed by its ledger, which knows every block and transaction the node has
+"""
+import numpy as np
+
+
+def peer_graph(num_nodes, degree, rng):
+    """
+    Random undirected graph where nodes have about degree peers: a random ring, which keeps every node reachable,
+    plus (degree - 2) / 2 random links from every node.  Returns the peers of every node in CSR form
+    (indptr, peers), where the peers of node i are peers[indptr[i]:indptr[i + 1]]
+    """
+    if num_nodes < 2:
+        return np.zeros(num_nodes + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    ring = rng.permutation(num_nodes)
+    src = [ring]
+    dst = [np.roll(ring, 1)]
+    extra = max(degree - 2, 0) // 2
+    if extra:
+        src.append(np.repeat(np.arange(num_nodes), extra))
+        # an offset in [1, num_nodes) never links a node to itself
+        dst.append((src[-1] + rng.integers(1, num_nodes, num_nodes * extra)) % num_nodes)
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+    edges = np.unique(np.stack([np.minimum(src, dst), np.maximum(src, dst)], axis=1), axis=0)
+    links = np.concatenate([edges, edges[:, ::-1]])
+    links = links[np.lexsort((links[:, 1], links[:, 0]))]
+    indptr = np.searchsorted(links[:, 0], np.arange(num_nodes + 1))
+    return indptr.astype(np.int64), links[:, 1].astype(np.int64)
+
+
+class Gossip:
+    """
+    Peer graph of the network and the seen-cache of every node.  A seen-cache holds the ids of the last cache_size
+    messages the node has seen, which saves asking the node's ledger about most duplicates; a message evicted from
+    it is still recognised by the ledger, so it is never relayed twice
+    """
+    def __init__(self, degree=8, cache_size=10000, rng=None):
+        self.degree = degree
+        self.cache_size = cache_size
+        self.rng = rng if rng is not None else np.random.default_rng() # picks the peer graph
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.peers = np.zeros(0, dtype=np.int64)
+        self.seen = []
+
+    def connect(self, num_nodes):
+        """
+        Builds the peer graph for the given number of nodes, with empty seen-caches
+        """
+        self.indptr, self.peers = peer_graph(num_nodes, self.degree, self.rng)
+        most_peers = int(np.diff(self.indptr).max(initial=0))
+        # every peer of a node can pass it the same message at once
+        if self.cache_size < max(most_peers, 1):
+            raise Exception(f"The seen-cache must hold at least as many messages as a node has peers ({most_peers}), got {self.cache_size}")
+        self.seen = [{} for _ in range(num_nodes)] # insertion ordered, so the oldest message is evicted first
+
+    def peers_of(self, node_id):
+        return self.peers[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def first_sight(self, node_id, key):
+        """
+        Records that the node has seen the message, and returns whether it is new to the node
+        """
+        seen = self.seen[node_id]
+        if key in seen:
+            return False
+        seen[key] = None
+        if len(seen) > self.cache_size:
+            del seen[next(iter(seen))]
+        return True
@@ -0,0 +1,60 @@
+"""
+Queues of packets waiting to be delivered to nodes.  Packets are grouped by arrival time and released as soon as
+they are delivered, so memory only grows with the number of packets in flight
+"""
+import numpy as np
+
+
+class Mailbox:
+    """
+    Shared mailbox for every node, mapping arrival times to the packets that arrive at that time.  Keeps track of
+    how many packets are waiting for each node
+    """
+    def __init__(self, num_nodes):
+        self.slots = {} # maps from arrival time to a list of (receiving node ids, packet)
+        self.depth = np.zeros(num_nodes, dtype=np.int64) # number of packets waiting for each node
+        self.pending = 0 # number of packets waiting across all nodes
+        self.peak_pending = 0
+        self.peak_depth = 0 # most packets ever waiting for a single node
+        self.delivered = 0
+
+    def __len__(self):
+        return self.pending
+
+    def put(self, time, node_ids, packet):
+        """
+        Queues a packet for the given nodes at the given arrival time.  Returns True if nothing else was
+        arriving at that time yet
+        """
+        new_slot = time not in self.slots
+        if new_slot:
+            self.slots[time] = []
+        self.slots[time].append((node_ids, packet))
+
+        self.depth[node_ids] += 1
+        self.pending += len(node_ids)
+        self.peak_pending = max(self.peak_pending, self.pending)
+        self.peak_depth = max(self.peak_depth, int(self.depth[node_ids].max()))
+        return new_slot
+
+    def pop(self, time):
+        """
+        Removes and returns every packet arriving at the given time
+        """
+        batches = self.slots.pop(time, [])
+        for node_ids, _ in batches:
+            self.depth[node_ids] -= 1
+            self.pending -= len(node_ids)
+            self.delivered += len(node_ids)
+        return batches
+
+    def stats(self):
+        """
+        Queue depth statistics for the run so far
+        """
+        return {
+            "pending_packets": self.pending,
+            "peak_pending_packets": self.peak_pending,
+            "peak_node_queue_depth": self.peak_depth,
+            "delivered_packets": self.delivered,
+        }
@@ -0,0 +1,96 @@
+"""
+Key providers that hand out (public key, private key) pairs to nodes.  The simulation never signs anything, so
+keys are only created when a node's keys are first accessed
+"""
+import hashlib
+import os
+
+from cryptography.hazmat.primitives import serialization as crypto_serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from util import generate_keys
+
+
+class LazyKeys:
+    """
+    Generates a fresh RSA key pair for a node the first time its keys are accessed
+    """
+    def __init__(self):
+        self.keys = {} # maps from node id to (public key, private key)
+
+    def get(self, node_id):
+        """
+        Returns the (public key, private key) pair of the given node
+        """
+        if node_id not in self.keys:
+            self.keys[node_id] = self.create(node_id)
+        return self.keys[node_id]
+
+    def create(self, node_id):
+        return generate_keys()
+
+
+class KeyStore(LazyKeys):
+    """
+    Persists generated RSA key pairs on disk so that they are reused across runs
+    """
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def create(self, node_id):
+        public_path = os.path.join(self.directory, f"node-{node_id}.pub")
+        private_path = os.path.join(self.directory, f"node-{node_id}.pem")
+        if os.path.exists(public_path) and os.path.exists(private_path):
+            with open(public_path, 'rb') as f:
+                public_key = f.read()
+            with open(private_path, 'rb') as f:
+                private_key = f.read()
+            return public_key, private_key
+
+        public_key, private_key = generate_keys()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(public_path, 'wb') as f:
+            f.write(public_key)
+        with open(private_path, 'wb') as f:
+            f.write(private_key)
+        return public_key, private_key
+
+
+class DeterministicKeys(LazyKeys):
+    """
+    Derives a cheap Ed25519 key pair for each node from a seed, so the same seed always gives the same keys
+    """
+    def __init__(self, seed=0):
+        super().__init__()
+        self.seed = seed
+
+    def create(self, node_id):
+        private_bytes = hashlib.sha256(f"{self.seed}-{node_id}".encode()).digest()
+        key = ed25519.Ed25519PrivateKey.from_private_bytes(private_bytes)
+
+        private_key = key.private_bytes(
+            crypto_serialization.Encoding.PEM,
+            crypto_serialization.PrivateFormat.PKCS8,
+            crypto_serialization.NoEncryption()
+        )
+
+        public_key = key.public_key().public_bytes(
+            crypto_serialization.Encoding.OpenSSH,
+            crypto_serialization.PublicFormat.OpenSSH
+        )
+
+        return public_key, private_key
+
+
+def make_key_provider(mode, directory="keys", seed=0):
+    """
+    Creates the key provider for the given mode (lazy, keystore or deterministic)
+    """
+    if mode == "lazy":
+        return LazyKeys()
+    if mode == "keystore":
+        return KeyStore(directory)
+    if mode == "deterministic":
+        return DeterministicKeys(seed)
+    raise Exception(f"Invalid key mode: {mode} does not exist!  Try using 'lazy', 'keystore' or 'deterministic'")
@@ -0,0 +1,160 @@
+"""
+Models of how long a packet waits to get onto the network before its propagation latency starts.  The network asks
+its link model for the extra delay of every packet it sends, and tells the model when a packet was delivered.
+
+Bandwidth: each node sends its packets first-in first-out at a fixed rate, either one queue for its whole uplink or
+one per link, so a node that sends a lot (a flooding miner, the centralized server) falls behind.
+Congestion: the original model, a random delay that grows with the number of packets in flight on a link.
+"""
+import numpy as np
+
+from constants import BLOCK
+from mempool import txn_size
+
+PACKET_OVERHEAD = 40 # bytes of headers on every packet
+BLOCK_HEADER = 80 # bytes of a block besides its transactions
+MAX_CONGESTION_EXPONENT = 62 # congestion delays have mean 2^(packets in flight); past this the mean would overflow
+
+
+def message_size(pkt, pkt_type):
+    """
+    Size of a packet in bytes
+    """
+    if pkt_type == BLOCK:
+        return PACKET_OVERHEAD + BLOCK_HEADER + sum(txn_size(txn) for txn in pkt.data)
+    return PACKET_OVERHEAD + txn_size(pkt)
+
+
+def mbps_to_bytes_per_ms(mbps):
+    return np.asarray(mbps, dtype=np.float64) * 125
+
+
+class BandwidthModel:
+    """
+    Every node serializes the packets it sends one at a time, in the order it sends them, at its bandwidth (bytes
+    per ms).  A packet can't start until the packets queued ahead of it are out, and its latency counts from when
+    its last byte is sent.  With per_link the node has a queue and the full bandwidth for each receiver, otherwise
+    all of its packets share one uplink queue.  Queues are kept as the time each one is next free, so a packet
+    costs O(1)
+    """
+    def __init__(self, bandwidth, per_link=False):
+        self.bandwidth = bandwidth # bytes per ms: one value for every node, or a list cycled over the nodes
+        self.per_link = per_link
+        self.rates = np.zeros(0, dtype=np.float64)
+        self.free_at = np.zeros(0, dtype=np.float64) # when each uplink (or link) has sent everything queued on it
+        self.bytes_sent = 0
+        self.packets = 0
+        self.waits = np.zeros(0, dtype=np.float64) # ms each node's packets spent queued behind its earlier packets
+        self.max_wait = 0.0
+
+    def connect(self, num_nodes):
+        """
+        Sets up empty queues for the given number of nodes
+        """
+        rates = np.atleast_1d(np.asarray(self.bandwidth, dtype=np.float64))
+        if (rates <= 0).any():
+            raise Exception(f"Bandwidth must be positive, got {self.bandwidth}")
+        self.rates = np.resize(rates, num_nodes)
+        shape = (num_nodes, num_nodes) if self.per_link else (num_nodes,)
+        self.free_at = np.zeros(shape, dtype=np.float64)
+        self.waits = np.zeros(num_nodes, dtype=np.float64)
+
+    def delays(self, time, sending_id, recieving_ids, size, pkt_type):
+        """
+        Queues one packet of size bytes from the sender to each of the recieving nodes (which can't include the
+        sender, or repeat) and returns how long after time each one is fully sent
+        """
+        count = len(recieving_ids)
+        # senders outside the network aren't queued
+        if not count or sending_id >= len(self.rates):
+            return np.zeros(count, dtype=np.int64)
+        send_time = size / self.rates[sending_id]
+        if self.per_link:
+            start = np.maximum(self.free_at[sending_id, recieving_ids], time)
+            done = start + send_time
+            self.free_at[sending_id, recieving_ids] = done
+            waits = start - time
+            self.waits[sending_id] += float(waits.sum())
+            self.max_wait = max(self.max_wait, float(waits.max()))
+        else:
+            start = max(self.free_at[sending_id], time)
+            # copies go out back to back on the uplink, the last of them waiting for all of the others
+            done = start + send_time * np.arange(1, count + 1)
+            self.free_at[sending_id] = done[-1]
+            waits = done - send_time - time
+            self.waits[sending_id] += float(waits.sum())
+            self.max_wait = max(self.max_wait, float(waits[-1]))
+        self.bytes_sent += size * count
+        self.packets += count
+        return (done - time).astype(np.int64)
+
+    def delay(self, time, sending_id, recieving_id, size, pkt_type):
+        """
+        Same as delays for a single recieving node, where a node sending to itself doesn't use the network
+        """
+        if sending_id == recieving_id:
+            return 0
+        return int(self.delays(time, sending_id, np.array([recieving_id]), size, pkt_type)[0])
+
+    def delivered(self, sending_id, recieving_id):
+        # a packet leaves its queue once it is sent, so delivery changes nothing
+        pass
+
+    def stats(self):
+        """
+        Traffic and queueing statistics for the run so far
+        """
+        return {
+            "bytes_sent": self.bytes_sent,
+            "average_queue_delay": float(self.waits.sum()) / self.packets if self.packets else 0,
+            "max_queue_delay": self.max_wait,
+        }
+
+
+class CongestionModel:
+    """
+    Original model: a packet on a link that already had a packet in flight is delayed by a poisson number of ms
+    with mean 2^(packets in flight on the link).  Blocks aren't delayed, but still count as in flight
+    """
+    def __init__(self, rng):
+        self.rng = rng # draws the congestion delays
+        self.in_transit = np.zeros((0, 0), dtype=np.int64) # number of packets in flight between each pair of nodes
+        self.linked = np.zeros((0, 0), dtype=bool) # whether a pair of nodes has ever had a packet in flight
+
+    def connect(self, num_nodes):
+        self.in_transit = np.zeros((num_nodes, num_nodes), dtype=np.int64)
+        self.linked = np.zeros((num_nodes, num_nodes), dtype=bool)
+
+    def delays(self, time, sending_id, recieving_ids, size, pkt_type):
+        # senders outside the network aren't congested
+        if sending_id >= len(self.linked):
+            return np.zeros(len(recieving_ids), dtype=np.int64)
+        linked = self.linked[sending_id, recieving_ids]
+        counts = self.in_transit[sending_id, recieving_ids]
+        delays = np.zeros(len(recieving_ids), dtype=np.int64)
+        if linked.any():
+            delays[linked] = self.rng.poisson(2.0 ** np.minimum(counts[linked], MAX_CONGESTION_EXPONENT))
+        self.in_transit[sending_id, recieving_ids] = counts + 1
+        self.linked[sending_id, recieving_ids] = True
+        if pkt_type == BLOCK:
+            return np.zeros(len(recieving_ids), dtype=np.int64)
+        return delays
+
+    def delay(self, time, sending_id, recieving_id, size, pkt_type):
+        if sending_id == recieving_id or sending_id >= len(self.linked):
+            return 0
+        if self.linked[sending_id, recieving_id]:
+            count = self.in_transit[sending_id, recieving_id]
+            self.in_transit[sending_id, recieving_id] += 1
+            delay = int(self.rng.poisson(2.0 ** min(count, MAX_CONGESTION_EXPONENT)))
+            return 0 if pkt_type == BLOCK else delay
+        self.linked[sending_id, recieving_id] = True
+        self.in_transit[sending_id, recieving_id] = 1
+        return 0
+
+    def delivered(self, sending_id, recieving_id):
+        if sending_id != recieving_id and sending_id < len(self.in_transit) and self.in_transit[sending_id, recieving_id] > 0:
+            self.in_transit[sending_id, recieving_id] -= 1
+
+    def stats(self):
+        return {}
@@ -0,0 +1,140 @@
+"""
+Pool of transactions a node has received but hasn't seen added to its chain yet
+"""
+from collections import deque
+
+COMPACT_SLACK = 32 # confirmed transactions the queue can hold beyond the waiting ones before it is compacted
+
+
+def txn_size(txn):
+    """
+    Size of a transaction in bytes
+    """
+    return len(txn.encode())
+
+
+class Mempool:
+    """
+    First-in first-out queue of unconfirmed transactions with an index of when each one arrived.  Transactions
+    confirmed by a block are dropped from the index right away and lazily removed from the queue once they reach
+    the front, or all at once when they make up most of it, so the queue stays within a constant factor of the
+    transactions waiting.  Transactions that arrive while the pool is full wait in an overflow queue, in the same way, and are
+    admitted in order as the pool frees up, so a full pool delays transactions but never loses them
+    """
+    def __init__(self, capacity=None):
+        if capacity is not None and capacity < 1:
+            raise Exception(f"A mempool must hold at least one transaction, got a capacity of {capacity}")
+        self.queue = deque()
+        self.members = {} # maps each waiting transaction to the time it arrived
+        self.capacity = capacity # most transactions the pool can hold, or None for no limit
+        self.peak_size = 0
+        self.overflow = deque()
+        self.waiting = {} # maps each transaction in the overflow to the time it arrived
+        self.deferred = 0 # transactions that had to wait in the overflow because the pool was full
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, txn):
+        return txn in self.members
+
+    def holds(self, txn):
+        """
+        Whether the transaction is waiting, in the pool or in its overflow
+        """
+        return txn in self.members or txn in self.waiting
+
+    def add(self, txn, time=0):
+        """
+        Adds a transaction that arrived at the given time to the back of the queue unless it is already waiting.
+        If the pool is full it goes to the back of the overflow instead, and False is returned
+        """
+        if txn in self.members or txn in self.waiting:
+            return False
+        if self.capacity is not None and len(self.members) >= self.capacity:
+            self.overflow.append(txn)
+            self.waiting[txn] = time
+            self.deferred += 1
+            return False
+        self.admit(txn, time)
+        return True
+
+    def admit(self, txn, time):
+        self.queue.append(txn)
+        self.members[txn] = time
+        self.peak_size = max(self.peak_size, len(self.members))
+
+    def refill(self):
+        """
+        Moves the oldest transactions of the overflow into the pool while there is room
+        """
+        while self.waiting and len(self.members) < self.capacity:
+            txn = self.overflow.popleft()
+            if txn in self.waiting:
+                self.admit(txn, self.waiting.pop(txn))
+
+    def remove(self, txn):
+        """
+        Drops a transaction that has been confirmed
+        """
+        self.members.pop(txn, None)
+        self.waiting.pop(txn, None)
+        if not self.waiting:
+            self.overflow.clear()
+        self.refill()
+        if len(self.queue) > 2 * len(self.members) + COMPACT_SLACK:
+            self.compact()
+
+    def compact(self):
+        """
+        Rebuilds the queue from the transactions that are still waiting, keeping their order
+        """
+        seen = set()
+        queue = deque()
+        for txn in self.queue:
+            if txn in self.members and txn not in seen:
+                seen.add(txn)
+                queue.append(txn)
+        self.queue = queue
+
+    def reorder(self):
+        """
+        Sorts the queue and the overflow by arrival time, once transactions of blocks that left the chain were put
+        back at the end.  Transactions that arrived at the same time keep their order
+        """
+        self.queue = deque(sorted(dict.fromkeys(txn for txn in self.queue if txn in self.members), key=self.members.__getitem__))
+        self.overflow = deque(sorted(dict.fromkeys(txn for txn in self.overflow if txn in self.waiting), key=self.waiting.__getitem__))
+
+    def trim(self):
+        """
+        Drops confirmed transactions from the front of the queue
+        """
+        while self.queue and self.queue[0] not in self.members:
+            self.queue.popleft()
+
+    def arrival(self, txn):
+        """
+        Time at which a waiting transaction arrived
+        """
+        return self.members[txn]
+
+    def batch(self, max_count, max_bytes=None):
+        """
+        Returns the oldest waiting transactions that fit in one block of at most max_count transactions and
+        max_bytes bytes, and whether that block is full.  A block always holds at least one transaction
+        """
+        self.trim()
+        txns = []
+        seen = set() # a transaction put back after a reorg can be queued twice
+        size = 0
+        for txn in self.queue:
+            if txn not in self.members or txn in seen:
+                continue
+            seen.add(txn)
+            if max_bytes is not None and txns and size + txn_size(txn) > max_bytes:
+                return txns, True
+            txns.append(txn)
+            size += txn_size(txn)
+            if len(txns) == max_count or (max_bytes is not None and size >= max_bytes):
+                return txns, True
+        return txns, False
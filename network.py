@@ -1,119 +1,454 @@
 """
 Contains the parent class and the subclasses that represent the different architectures (Cenralized, PoW, PoS)
 """
+import logging
+
+from constants import ACTION, BLOCK, DELIVERY, MINE, TRANSACTION
+from eventlog import BLOCK_PACKET, CONSENSUS, MAJORITY, MEMPOOL, MINED, SENT, SUBMITTED, TRANSACTION_PACKET, NullSink
+from events import EventQueue
+from inbox import Mailbox
+from links import CongestionModel, message_size
+from profiler import NullProfiler
+from rng import RandomStreams
+from sketch import QuantileSketch
+from stake import Stakes
+from tracker import ConfirmationTracker
 
-from constants import BLOCK, TRANSACTION
-
-import random
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
 class Network:
     """
     Parent class for all of the networks
     """
-    def __init__(self, nodes, latency_fn, schedule):
+    broadcasts_transactions = False # whether transactions go to every node (and are gossiped) rather than to one node
+
+    def __init__(self, nodes, latency_fn, schedule, rng=None, gossip=None, links=None):
         self.nodes = nodes
+        self.rng = rng if rng is not None else RandomStreams() # random streams for congestion and validator selection
         self.time = 0
         self.latency_fn = latency_fn 
-        self.latencies = {} # maps from block id to time it took to get a majority consensus
-        self.consensus_times = {} # maps from block id to time it took to get consensus among all nodes
-        self.incoming_messages = {} # maps from node id to a dictionary mapping times to (incoming data, type of packet)
-        self.schedule = schedule # maps the time and the list of transactions that will happen at that time
-        self.last_block_id = len(schedule) # TODO: this isn't true when we have multiple txn in a block
+        self.start_times = {} # maps each transaction id to its index and the time it was submitted, until all nodes agree on it
+        self.table = None # blocks and transaction ids shared by the ledgers of every node
+        self.blocks_mined = 0
+        self.first_submit_time = None
+        self.last_consensus_time = None
+        self.latency_sketch = QuantileSketch() # distribution of the time it took each transaction to get a majority consensus
+        self.consensus_sketch = QuantileSketch() # distribution of the time it took each transaction to get consensus among all nodes
+        self.log = NullSink() # where events are recorded as they happen
+        self.log_position = None # position in the log as of the last snapshot
+        self.incoming_messages = Mailbox(0) # packets (incoming data, type of packet, sender id) waiting to be delivered
+        self.schedule = schedule # source of the transactions submitted at each time, read one time step at a time
+        self.schedule_done = False # whether every transaction in the schedule has been submitted
         self.transaction_num = 1
         self.packets_sent = 0
+        self.duplicate_packets = 0 # gossiped packets dropped because the receiving node had already seen them
         self.num_computations = 0
-        self.in_transit = {}
+        self.gossip = gossip # peer graph and seen-caches when broadcasts are relayed by gossip instead of flooded
+        self.block_sent = {} # maps from block hash to the time it was broadcast and the number of nodes it reached, until it reaches all of them
+        self.propagation_sketch = QuantileSketch() # distribution of the time it took a broadcast block to reach each node
+        self.full_propagation_sketch = QuantileSketch() # distribution of the time it took a broadcast block to reach every node
+        self.links = links if links is not None else CongestionModel(self.rng.congestion) # extra delay of every packet before its latency
+        self.tracker = ConfirmationTracker(0)
+        self.events = EventQueue() # pending actions, deliveries and mining attempts ordered by time
+        self.scheduled_mines = set() # (node id, time) of every scheduled mining attempt
+        self.sample_interval = 100 # how often (in ms) the total size of the mempools is logged
+        self.next_sample = 0
+        self.checkpointer = None # writes periodic snapshots of the network when set
+        self.profiler = NullProfiler() # times each phase of the event loop when profiling is on
+        self.queue_next_action()
 
     def assign_nodes(self, nodes):
         """
         Updates the nodes in the network
         """
         self.nodes = nodes
+        self.node_ids = np.array([n.id for n in self.nodes], dtype=np.int64)
+        self.tracker = ConfirmationTracker(len(self.nodes))
+        self.table = self.nodes[0].ledger.table if self.nodes else None
+        if self.gossip is not None:
+            self.gossip.connect(len(self.nodes))
+        self.incoming_messages = Mailbox(len(self.nodes))
+        self.links.connect(len(self.nodes))
         for n in self.nodes:
-            self.incoming_messages[n.id] = {}
+            n.ledger.track(self.tracker)
 
     def check_for_majority(self):
         """
-        Looks over all nodes and checks to see which block index is agreed upon by the majority of nodes
+        Returns the transactions that have been in the chains of a majority of nodes for the first time since the
+        last check
         """
-        most_recent_blocks = [n.ledger.genesis_block for n in self.nodes]
-        exhaused_nodes = set([])
-        most_recent_block = most_recent_blocks[0]
-        majority = round(len(self.nodes)/2)
-        while True:
-            for i in range(len(self.nodes)):
-                if i in exhaused_nodes:
-                    continue
-                next_block = most_recent_blocks[i].next_block
-                if next_block is None:
-                    exhaused_nodes.add(i)
-                most_recent_blocks[i] = next_block
-            # check if less than a majority has agreed upon an incoming block
-            if len(self.nodes) - len(exhaused_nodes) < majority:
-                return most_recent_block.block_id
-            
-            for i in range(len(self.nodes)):
-                if i not in exhaused_nodes:
-                    most_recent_block = most_recent_blocks[i]
-                    break
+        return self.tracker.take_majority()
     
     def check_for_consensus(self):
         """
-        Looks over all nodes and checks to see which block index is agreed upon amongst all nodes
+        Returns the transactions that have been in the chains of all nodes for the first time since the last check
         """
-        most_recent_blocks = [n.ledger.genesis_block for n in self.nodes]
-        most_recent_block = most_recent_blocks[0]
-        while True:
-            for i in range(len(self.nodes)):
-                next_block = most_recent_blocks[i].next_block
-                if next_block is None:
-                    return most_recent_block.block_id
-                most_recent_blocks[i] = next_block
-            most_recent_block = most_recent_blocks[0]
+        return self.tracker.take_consensus()
     
-    def calculate_latency(self, ind):
+    def calculate_latency(self, txn_ids):
         """
-        Checks which blocks are verified, and calculates the latency for these blocks
+        Calculates and logs the latency for the transactions that have been verified since the last check
         """
-        for i in range(1, ind+1):
-            if 'LATENCY' in self.latencies[i]:
+        for txn_id in txn_ids:
+            if txn_id not in self.start_times:
                 continue
-            self.latencies[i]['LATENCY'] = self.time - self.latencies[i]['start']
-        # print("LATENCIES", self.latencies, self.time)
+            i, start_time = self.start_times[txn_id]
+            latency = self.time - start_time
+            self.latency_sketch.add(latency)
+            self.log.write(MAJORITY, self.time, i, latency)
     
-    def calculate_consensus(self, ind):
+    def calculate_consensus(self, txn_ids):
+        """
+        Calculates and logs the latency for the transactions that have been agreed upon by all nodes since the last
+        check
+        """
+        for txn_id in txn_ids:
+            if txn_id not in self.start_times:
+                continue
+            # all nodes agree on this transaction, so there is nothing left to track for it
+            i, start_time = self.start_times.pop(txn_id)
+            latency = self.time - start_time
+            self.consensus_sketch.add(latency)
+            self.log.write(CONSENSUS, self.time, i, latency)
+            self.last_consensus_time = self.time
+
+    def record_block(self, block):
+        """
+        Counts a newly made block
+        """
+        self.blocks_mined += 1
+
+    def summary(self):
+        """
+        Final metrics of the run, derived from the same events that are logged
+        """
+        num_transactions = self.transaction_num - 1
+        confirmed = num_transactions - len(self.start_times)
+        elapsed = self.last_consensus_time - self.first_submit_time if self.last_consensus_time is not None else 0
+        chain = self.chain_stats()
+        return {
+            "num_computations": self.num_computations,
+            "num_packets": self.packets_sent,
+            "num_duplicate_packets": self.duplicate_packets,
+            "num_transactions": num_transactions,
+            "num_blocks": self.blocks_mined,
+            # blocks that aren't on the longest chain of any node
+            "num_stale_blocks": self.blocks_mined - chain["on_chain"],
+            "num_reorgs": chain["reorgs"],
+            "max_reorg_depth": chain["max_reorg_depth"],
+            # transactions agreed upon by all nodes per second, from the first submission to the last agreement
+            "throughput_tps": 1000 * confirmed / elapsed if elapsed else 0,
+            "average_latency": self.latency_sketch.total / num_transactions if num_transactions else 0,
+            "average_consensus_latency": self.consensus_sketch.total / num_transactions if num_transactions else 0,
+            "latency_percentiles": self.latency_sketch.percentiles(),
+            "consensus_percentiles": self.consensus_sketch.percentiles(),
+            "block_propagation_percentiles": self.propagation_sketch.percentiles(),
+            "full_block_propagation_percentiles": self.full_propagation_sketch.percentiles(),
+            # sketches from several runs merge exactly with QuantileSketch.merge
+            "latency_sketch": self.latency_sketch.to_dict(),
+            "consensus_sketch": self.consensus_sketch.to_dict(),
+            "end_time": self.time,
+        }
+
+    def chain_hashes(self):
+        """
+        Hashes of every block past genesis that is on the chain of at least one node
+        """
+        chains = [n.ledger.chain[1:n.ledger.length] for n in self.nodes]
+        if not chains:
+            return np.zeros(0, dtype=np.uint64)
+        return np.unique(self.table.hash[np.concatenate(chains)])
+
+    def chain_stats(self):
+        """
+        Longest chain of any node, the number of blocks on the chain of any node, and the number of reorgs and
+        deepest reorg across all nodes
+        """
+        return {
+            "tip_height": max((n.ledger.tip_height() for n in self.nodes), default=0),
+            "on_chain": len(self.chain_hashes()),
+            "reorgs": sum(n.ledger.reorgs for n in self.nodes),
+            "max_reorg_depth": max((n.ledger.max_reorg_depth for n in self.nodes), default=0),
+        }
+
+    def search_for_txns(self, timestamp):
+        """
+        Removes the incoming messages at the given time from the mailbox, and groups them by the receiving
+        node in the order they were sent
+        """
+        incoming_packets = {}
+        for node_ids, packet in self.incoming_messages.pop(timestamp):
+            for node_id in node_ids:
+                if node_id not in incoming_packets:
+                    incoming_packets[node_id] = []
+                incoming_packets[node_id].append(packet)
+        return incoming_packets
+
+    def deliver(self, node_id, future_time, packet):
+        """
+        Places a packet into the given node's queue and schedules its delivery at the given time
+        """
+        self.deliver_many([node_id], future_time, packet)
+
+    def deliver_many(self, node_ids, future_time, packet):
+        """
+        Places one packet into the queues of all of the given nodes to be delivered at the same time
+        """
+        if self.incoming_messages.put(future_time, node_ids, packet):
+            self.events.push(future_time, DELIVERY)
+
+    def fan_out(self, node_ids, future_times, packet):
+        """
+        Delivers one packet to many nodes, each at its own arrival time, grouping the nodes that share an
+        arrival time into a single delivery
+        """
+        order = np.argsort(future_times, kind='stable')
+        future_times = future_times[order]
+        node_ids = node_ids[order]
+        arrival_times, starts = np.unique(future_times, return_index=True)
+        for future_time, group in zip(arrival_times.tolist(), np.split(node_ids, starts[1:])):
+            self.deliver_many(group.tolist(), future_time, packet)
+
+    def schedule_mine(self, node_id, time):
+        """
+        Schedules a mining attempt for the given node, at most one per node per time
+        """
+        if (node_id, time) in self.scheduled_mines:
+            return
+        self.scheduled_mines.add((node_id, time))
+        self.events.push(time, MINE, node_id)
+
+    def check_for_termination(self):
+        """
+        Updates the latencies of newly verified blocks and returns the final metrics once all transactions
+        have been verified across all nodes
+        """
+        self.calculate_latency(self.check_for_majority())
+        self.calculate_consensus(self.check_for_consensus())
+
+        if self.schedule_done and not self.start_times:
+            return self.finish()
+        return None
+
+    def finish(self):
+        """
+        Flushes the log and reports the final metrics
+        """
+        self.log.flush()
+        summary = self.summary()
+        logger.info(f"Average Latency: {summary['average_latency']}\nAverage Consensus Latency: {summary['average_consensus_latency']}\nNumber of Computations: {self.num_computations}\nPackets Sent {self.packets_sent}")
+        return summary
+
+    def run(self):
+        """
+        Processes events in time order, skipping over times where nothing happens, until all transactions
+        have been verified across all nodes
+        """
+        self.profiler.begin(self.time)
+        while True:
+            if self.checkpointer is not None and self.checkpointer.due(self.time):
+                with self.profiler.phase("checkpoint"):
+                    self.checkpointer.save(self)
+            with self.profiler.phase("termination"):
+                res = self.check_for_termination()
+            if res is not None:
+                return res
+            next_time = self.events.peek_time()
+            if next_time is None:
+                raise Exception(f"No pending events at time {self.time} but not all transactions have been verified")
+            if next_time >= self.next_sample:
+                with self.profiler.phase("sampling"):
+                    self.sample_mempools()
+                self.next_sample = (next_time // self.sample_interval + 1) * self.sample_interval
+            self.time = next_time
+            self.tick()
+            # the state at the end of a time step is observed at the start of the following millisecond
+            self.time += 1
+
+    def __getstate__(self):
+        # the log is reopened from this position when resuming
+        state = self.__dict__.copy()
+        state['checkpointer'] = None
+        state['profiler'] = NullProfiler()
+        state['log'] = None
+        state['log_position'] = self.log.position()
+        return state
+
+    def sample_mempools(self):
+        """
+        Logs how many transactions are waiting to be mined across all nodes
+        """
+        sizes = [len(n.ledger.unconfirmed_txns) for n in self.nodes]
+        self.log.write(MEMPOOL, self.time, sum(sizes), max(sizes, default=0))
+        self.profiler.peak("event_queue", len(self.events))
+        self.profiler.peak("packets_in_flight", len(self.incoming_messages))
+        self.profiler.peak("total_mempool_size", sum(sizes))
+        self.profiler.peak("largest_mempool_size", max(sizes, default=0))
+
+    def mempool_stats(self):
+        """
+        Mempool size statistics for the run so far
+        """
+        return {
+            "peak_mempool_size": max((n.ledger.unconfirmed_txns.peak_size for n in self.nodes), default=0),
+            "deferred_txns": sum(n.ledger.unconfirmed_txns.deferred for n in self.nodes),
+        }
+
+    def load_counters(self):
+        """
+        Protocol specific counters, each kept as an attribute, that add up across the nodes (or partitions of
+        nodes) that counted them
+        """
+        return {}
+
+    def tick(self):
+        """
+        Processes every event scheduled for the current time
+        """
+        while self.events.peek_time() == self.time:
+            _, kind, node_id = self.events.pop()
+            if kind == ACTION:
+                with self.profiler.phase("actions"):
+                    self.apply_actions()
+            elif kind == DELIVERY:
+                with self.profiler.phase("delivery"):
+                    self.deliver_packets()
+            elif kind == MINE:
+                self.scheduled_mines.discard((node_id, self.time))
+                self.begin_event(MINE, node_id)
+                with self.profiler.phase("mining"):
+                    self.mine(self.nodes[node_id])
+
+    def deliver_packets(self):
+        """
+        Hands every packet arriving at the current time to its receiving node, in order of node id
+        """
+        incoming_packets = self.search_for_txns(self.time)
+        for node_id in sorted(incoming_packets):
+            self.begin_event(DELIVERY, node_id)
+            packets = incoming_packets[node_id]
+            if self.gossip is not None:
+                packets = self.relay_new(node_id, packets)
+            verified_blocks, transactions = self.seperate_packets(packets)
+            for block, _ in verified_blocks:
+                self.block_arrived(block.block_hash)
+            self.receive(self.nodes[node_id], verified_blocks, transactions)
+
+    def message_key(self, pkt, pkt_type):
+        """
+        Integer that identifies a gossiped block or transaction
+        """
+        if pkt_type == BLOCK:
+            return 2 * pkt.index
+        return 2 * self.table.txn_id(pkt) + 1
+
+    def relay_new(self, node_id, packets):
         """
-        Checks which blocks are verified and agreed upon by all nodes, and calculates the latency for these blocks
+        Drops the packets the node has already seen and relays the rest to its peers.  Returns the new packets
         """
-        for i in range(1, ind+1):
-            if 'LATENCY' in self.consensus_times[i]:
+        ledger = self.nodes[node_id].ledger
+        fresh = []
+        for pkt, pkt_type, sender_id in packets:
+            # a node's own transaction is delivered to itself without going through gossip, and transactions sent to
+            # a single node aren't relayed
+            if sender_id == node_id or (pkt_type == TRANSACTION and not self.broadcasts_transactions):
+                fresh.append((pkt, pkt_type, sender_id))
+                continue
+            # the seen-cache catches recent duplicates cheaply, and the ledger anything evicted from it, so every
+            # node relays a message at most once
+            new = self.gossip.first_sight(node_id, self.message_key(pkt, pkt_type))
+            if not new or (ledger.has_block(pkt.index) if pkt_type == BLOCK else ledger.has_txn(pkt)):
+                self.duplicate_packets += 1
+                self.links.delivered(sender_id, node_id)
                 continue
-            self.consensus_times[i]['LATENCY'] = self.time - self.consensus_times[i]['start']
+            fresh.append((pkt, pkt_type, sender_id))
+            self.relay(node_id, sender_id, pkt, pkt_type)
+        return fresh
+
+    def relay(self, node_id, exclude_id, pkt, pkt_type):
+        """
+        Sends a packet from the node to each of its gossip peers other than exclude_id
+        """
+        with self.profiler.phase("relay"):
+            peers = self.gossip.peers_of(node_id)
+            peers = peers[peers != exclude_id]
+            if not len(peers):
+                return
+            delays = self.get_delays(node_id, peers)
+            additional_delays = self.links.delays(self.time, node_id, peers, message_size(pkt, pkt_type), pkt_type)
+            self.fan_out(peers, self.time + delays + additional_delays, (pkt, pkt_type, node_id))
+            self.packets_sent += len(peers)
+            self.log.write(SENT, self.time, node_id, len(peers), BLOCK_PACKET if pkt_type == BLOCK else TRANSACTION_PACKET)
+
+    def begin_event(self, kind, index):
+        """
+        Called before each action, each node's deliveries and each mining attempt of a time step, in the order they
+        are processed.  Only a partitioned run needs to know, to order what they do across partitions
+        """
+        pass
+
+    def owns(self, node_id):
+        """
+        Whether this network simulates the given node, which is every node unless the run is partitioned
+        """
+        return True
+
+    def block_arrived(self, block_hash):
+        """
+        Records how long a broadcast block took to reach another node
+        """
+        if block_hash not in self.block_sent:
+            return
+        sent_time, reached = self.block_sent[block_hash]
+        delay = self.time - sent_time
+        self.propagation_sketch.add(delay)
+        reached += 1
+        if reached == len(self.nodes) - 1:
+            self.full_propagation_sketch.add(delay)
+            del self.block_sent[block_hash]
+        else:
+            self.block_sent[block_hash] = (sent_time, reached)
+
+    def receive(self, node, verified_blocks, transactions):
+        """
+        Handles the blocks and transactions delivered to a node at the current time
+        """
+        raise NotImplementedError
 
-    def search_for_txns(self, node_id, timestamp):
+    def mine(self, node):
         """
-        Look for incoming messages for the given node at the current time
+        Performs one mining attempt on the given node
         """
-        assert node_id in self.incoming_messages, f"node-{node_id} is not in the dictionary storing queues for nodes"
-        # no incoming packets
-        if self.time not in self.incoming_messages[node_id]:
-            return []
-        return self.incoming_messages[node_id][timestamp]
+        pass
 
     def apply_actions(self):
         """
-        Takes all actions in the passed in schedule for the current time and processees the action
+        Takes all actions in the schedule for the current time and processees the action
         """
-        if self.time in self.schedule:
-            actions = self.schedule[self.time]
-            for sender_id, data in actions:
-                # initialze latency and consensus dictionaries for the block
-                self.latencies[self.transaction_num] = {'start': self.time}
-                self.consensus_times[self.transaction_num] = {'start': self.time}
-                self.transaction_num += 1
+        for i, (sender_id, data) in enumerate(self.schedule.pop()):
+            self.begin_event(ACTION, i)
+            # start tracking the latency of the transaction
+            self.start_times[self.table.txn_id(data)] = (self.transaction_num, self.time)
+            if self.first_submit_time is None:
+                self.first_submit_time = self.time
+            self.log.write(SUBMITTED, self.time, self.transaction_num, sender_id)
+            self.transaction_num += 1
+            if self.owns(sender_id):
                 self.add_transaction(data, sender_id)
+        self.queue_next_action()
+
+    def queue_next_action(self):
+        """
+        Schedules the next time step of the schedule, or notes that the schedule has run out
+        """
+        next_time = self.schedule.peek_time()
+        if next_time is None:
+            self.schedule_done = True
+        else:
+            self.events.push(next_time, ACTION)
 
     def seperate_packets(self, packets):
         """
@@ -131,53 +466,64 @@ class Network:
 
     def broadcast_block(self, block, sending_node_id):
         """
-        Broadcasts a verfied block to all nodes in the network
+        Broadcasts a verfied block to all nodes in the network, either directly or through gossip
         """
-        for node in self.nodes:
+        with self.profiler.phase("broadcast"):
+            if len(self.nodes) > 1:
+                self.block_sent[block.block_hash] = (self.time, 0)
+            if self.gossip is not None:
+                self.gossip.first_sight(sending_node_id, self.message_key(block, BLOCK))
+                self.relay(sending_node_id, -1, block, BLOCK)
+                return
             # don't need to send the sender the block it verified
-            if sending_node_id == node.id:
-                continue
-
-            assert node.id in self.incoming_messages, f"node-{node.id} is not in the dictionary storing queues for nodes"
-            delay = self.latency_fn(sending_node_id, node.id)
-            additional_delay = self.get_additional_delay(sending_node_id, node.id)
-            future_time = self.time + delay
-            if future_time not in self.incoming_messages[node.id]:
-                self.incoming_messages[node.id][future_time] = []
-            self.incoming_messages[node.id][future_time].append((block, BLOCK, sending_node_id))
-            self.packets_sent += 1
-
-    def get_additional_delay(self, sending_id, recieving_id):
-        if sending_id == recieving_id:
-            return 0
-        
-        if (sending_id, recieving_id) in self.in_transit:
-            count = self.in_transit[(sending_id, recieving_id)]
-            self.in_transit[(sending_id, recieving_id)] += 1
-            return np.random.poisson(2**count)
-
-        self.in_transit[(sending_id, recieving_id)] = 1
-        return 0
-
-    def remove_from_transit(self, sending_id, recieving_id):
-        if sending_id == recieving_id:
+            node_ids = self.node_ids[self.node_ids != sending_node_id]
+            delays = self.get_delays(sending_node_id, node_ids)
+            additional_delays = self.links.delays(self.time, sending_node_id, node_ids, message_size(block, BLOCK), BLOCK)
+            self.fan_out(node_ids, self.time + delays + additional_delays, (block, BLOCK, sending_node_id))
+            self.packets_sent += len(node_ids)
+            self.log.write(SENT, self.time, sending_node_id, len(node_ids), BLOCK_PACKET)
+
+    def broadcast_transaction(self, txn, sending_node_id):
+        """
+        Sends a new transaction to every node in the network, the sender included, either directly or through
+        gossip
+        """
+        # a sender outside the network has no peers, so it sends to every node itself
+        outside = sending_node_id >= len(self.nodes)
+        # don't need to send the sender the transaction it is sending out
+        if not outside:
+            self.deliver(sending_node_id, self.time, (txn, TRANSACTION, sending_node_id))
+        if self.gossip is not None and not outside:
+            self.gossip.first_sight(sending_node_id, self.message_key(txn, TRANSACTION))
+            self.relay(sending_node_id, -1, txn, TRANSACTION)
             return
 
-        if (sending_id, recieving_id) in self.in_transit and self.in_transit[(sending_id, recieving_id)] > 0:
-            self.in_transit[(sending_id, recieving_id)] -= 1
+        node_ids = self.node_ids[self.node_ids != sending_node_id]
+        delays = self.get_delays(sending_node_id, node_ids)
+        additional_delays = self.links.delays(self.time, sending_node_id, node_ids, message_size(txn, TRANSACTION), TRANSACTION)
+        self.fan_out(node_ids, self.time + delays + additional_delays, (txn, TRANSACTION, sending_node_id))
+        self.packets_sent += len(node_ids)
+        self.log.write(SENT, self.time, sending_node_id, len(node_ids), TRANSACTION_PACKET)
+
+    def get_delays(self, sending_id, recieving_ids):
+        """
+        Draws the latency from the sending node to each of the recieving nodes, in one call when the latency
+        function supports it
+        """
+        if hasattr(self.latency_fn, "row"):
+            return self.latency_fn.row(sending_id, recieving_ids)
+        return np.array([self.latency_fn(sending_id, i) for i in recieving_ids.tolist()], dtype=np.int64)
 
     
 class CentralizedNetwork(Network):
     """
     Centralized architecture where the first node is the centralized server that handles transactions
     """
-    def __init__(self, nodes, latency_fn, schedule):
-        super().__init__(nodes, latency_fn, schedule)
+    def __init__(self, nodes, latency_fn, schedule, rng=None, gossip=None, links=None):
+        super().__init__(nodes, latency_fn, schedule, rng, gossip, links)
     
     def assign_nodes(self, nodes):
-        self.nodes = nodes
-        for n in self.nodes:
-            self.incoming_messages[n.id] = {}
+        super().assign_nodes(nodes)
         # set centralized server to be the first node
         self.centralized_server = self.nodes[0]
 
@@ -186,184 +532,198 @@ class CentralizedNetwork(Network):
         Sends a new transaction to the centralized server to process
         """
         delay = self.latency_fn(sending_node_id, self.centralized_server.id)
-        additional_delay = self.get_additional_delay(sending_node_id, self.centralized_server.id)
+        additional_delay = self.links.delay(self.time, sending_node_id, self.centralized_server.id, message_size(txn, TRANSACTION), TRANSACTION)
         future_time = self.time + delay + additional_delay
-        if future_time not in self.incoming_messages[self.centralized_server.id]:
-            self.incoming_messages[self.centralized_server.id][future_time] = []
-        self.incoming_messages[self.centralized_server.id][future_time].append((txn, TRANSACTION, sending_node_id))
+        self.deliver(self.centralized_server.id, future_time, (txn, TRANSACTION, sending_node_id))
         self.packets_sent += 1
+        self.log.write(SENT, self.time, sending_node_id, 1, TRANSACTION_PACKET)
     
-    def tick(self):
+    def receive(self, node, verified_blocks, transactions):
         """
-        Runs computations on each node for one "time" tick
-        """
-        ind = self.check_for_majority()
-        consensus_ind = self.check_for_consensus()
-        self.calculate_latency(ind)
-        self.calculate_consensus(consensus_ind)
-        
-        # termination condition
-        if consensus_ind == self.last_block_id:
-            print(f"Latencies: {self.latencies}\nConsensus: {self.consensus_times}\nNumber of Computations: {self.num_computations}\nPackets Sent {self.packets_sent}")
-            return self.latencies, self.consensus_times, self.num_computations, self.packets_sent
-
-        self.apply_actions()     
-
-        for node in self.nodes:
-            # node checks if it has any actions at this time (send txn or add block) -- incoming messages
-            incoming_packets = self.search_for_txns(node.id, self.time)
-            verified_blocks, transactions = self.seperate_packets(incoming_packets)
-            # handle the verified blocks first
-            for pkt, sender_id in sorted(verified_blocks, key=lambda x: x[0].block_id):
-                node.add_block_centralized(pkt)
-                self.remove_from_transit(sender_id, node.id)
-            for pkt, sender_id in transactions:
-                new_block = node.ledger.process_txn(pkt)
-                node.add_block_centralized(new_block)
-                self.broadcast_block(new_block, node.id)
-                self.remove_from_transit(sender_id, node.id)
-        self.time += 1
+        Adds incoming blocks to the node's chain, and queues incoming transactions for the centralized server
+        to put into blocks
+        """
+        # handle the verified blocks first
+        for pkt, sender_id in sorted(verified_blocks, key=lambda x: x[0].block_id):
+            node.add_block_centralized(pkt)
+            self.links.delivered(sender_id, node.id)
+        for pkt, sender_id in transactions:
+            node.ledger.add_incoming_txn(pkt, self.time)
+            self.links.delivered(sender_id, node.id)
+        ready = node.ledger.batch_ready_time(self.time)
+        if ready is not None:
+            self.schedule_mine(node.id, ready)
+
+    def mine(self, node):
+        """
+        The centralized server creates and broadcasts a block for every batch of transactions that is ready
+        """
+        while True:
+            new_block = node.ledger.process_txns(self.time)
+            if new_block is None:
+                break
+            node.add_block_centralized(new_block)
+            self.record_block(new_block)
+            self.log.write(MINED, self.time, node.id, new_block.block_id, 0)
+            self.broadcast_block(new_block, node.id)
+        ready = node.ledger.batch_ready_time(self.time)
+        if ready is not None:
+            self.schedule_mine(node.id, ready)
 
 
 class ProofOfWorkNetwork(Network):
     """
     Proof of Work architecture
     """
-    def __init__(self, nodes, latency_fn, schedule):
-        super().__init__(nodes, latency_fn, schedule)
+    broadcasts_transactions = True
+
+    def __init__(self, nodes, latency_fn, schedule, rng=None, gossip=None, links=None):
+        super().__init__(nodes, latency_fn, schedule, rng, gossip, links)
     
     def add_transaction(self, txn, sending_node_id):
         """
         Sends a new transaction to the blockchain ledger to all neighboring nodes in the network
         """
-        for node in self.nodes:
-            # don't need to send the sender the transaction it is sending out
-            if sending_node_id == node.id:
-                if self.time not in self.incoming_messages[node.id]:
-                    self.incoming_messages[node.id][self.time] = []
-                self.incoming_messages[node.id][self.time].append((txn, TRANSACTION, sending_node_id))
-                continue
-            
-            assert node.id in self.incoming_messages, f"node-{node.id} is not in the dictionary storing queues for nodes"
-            delay = self.latency_fn(sending_node_id, node.id)
-            additional_delay = self.get_additional_delay(sending_node_id, node.id)
-            future_time = self.time + delay +additional_delay
-            if future_time not in self.incoming_messages[node.id]:
-                self.incoming_messages[node.id][future_time] = []
-            self.incoming_messages[node.id][future_time].append((txn, TRANSACTION, sending_node_id))
-            self.packets_sent += 1
+        self.broadcast_transaction(txn, sending_node_id)
 
-    def tick(self):
+    def receive(self, node, verified_blocks, transactions):
         """
-        Runs computations on each node for one "time" tick
-        """
-        print(self.in_transit)
-        ind = self.check_for_majority()
-        consensus_ind = self.check_for_consensus()
-        self.calculate_latency(ind)
-        self.calculate_consensus(consensus_ind)
-
-        # termination condition
-        if consensus_ind == self.last_block_id:
-            print(f"Latencies: {self.latencies}\nConsensus: {self.consensus_times}\nNumber of Computations: {self.num_computations}\nPackets Sent {self.packets_sent}")
-            return self.latencies, self.consensus_times, self.num_computations, self.packets_sent
-
-        self.apply_actions()     
-
-        for node in self.nodes:
-            # node checks if it has any actions at this time (send txn or add block) -- incoming messages
-            incoming_packets = self.search_for_txns(node.id, self.time)
-            verified_blocks, transactions = self.seperate_packets(incoming_packets)
-            for pkt, sender_id in sorted(verified_blocks, key=lambda x: x[0].block_id):
-                node.add_block(pkt)
-                self.remove_from_transit(sender_id, node.id)
-            for pkt, sender_id in transactions:
-                node.ledger.add_incoming_txn(pkt)
-                self.remove_from_transit(sender_id, node.id)
-        
-        # perform mining on each node
-        for node in self.nodes:
-            res = node.mine()
-
-            # if we have found a solution
-            if res is not None:
-                new_block, num_computations = res
-                self.num_computations += num_computations
-                # notify neighbors of the new block mined
-                self.broadcast_block(new_block, node.id)
-        self.time += 1
+        Adds incoming blocks to the node's chain and queues incoming transactions to be mined
+        """
+        for pkt, sender_id in sorted(verified_blocks, key=lambda x: x[0].block_id):
+            node.add_block(pkt)
+            self.links.delivered(sender_id, node.id)
+        for pkt, sender_id in transactions:
+            node.ledger.add_incoming_txn(pkt, self.time)
+            self.links.delivered(sender_id, node.id)
+        # a new block can make the block being mined stale even when there's nothing left to mine
+        if node.ledger.unconfirmed_txns or node.ledger.candidate is not None:
+            self.schedule_mine(node.id, self.time)
+
+    def mine(self, node):
+        """
+        Performs proof of work on the node, and keeps mining while it has unconfirmed transactions.  The next
+        attempt is scheduled for when the node will have computed enough hashes to solve its current block
+        """
+        res = node.mine(self.time)
+
+        # if we have found a solution
+        if res is not None:
+            new_block, num_computations = res
+            self.num_computations += num_computations
+            self.record_block(new_block)
+            self.log.write(MINED, self.time, node.id, new_block.block_id, num_computations)
+            # notify neighbors of the new block mined
+            self.broadcast_block(new_block, node.id)
+        if node.ledger.unconfirmed_txns:
+            self.schedule_mine(node.id, node.ledger.next_attempt(self.time))
+
 
 class ProofOfStakeNetwork(Network):
     """
-    Proof of Stake architecture
+    Proof of Stake architecture: the blocks of each epoch are all proposed by one validator, drawn by stake.  With a
+    single validator transactions are sent straight to it, and when validators rotate every transaction is sent
+    once to every node, so each validator already holds the transactions waiting when its epoch starts
     """
-    def __init__(self, nodes, latency_fn, schedule):
-        super().__init__(nodes, latency_fn, schedule)
+    def __init__(self, nodes, latency_fn, schedule, rng=None, gossip=None, links=None, stakes=None, epoch_length=0):
+        self.stakes = stakes # stake of every node and the proposer of every epoch, equal stakes if None
+        self.epoch_length = epoch_length # number of blocks proposed by each validator in a row, 0 for a single epoch
+        self.broadcasts_transactions = epoch_length > 0
+        super().__init__(nodes, latency_fn, schedule, rng, gossip, links)
 
     def assign_nodes(self, nodes):
-        self.nodes = nodes
-        for n in self.nodes:
-            self.incoming_messages[n.id] = {}
-        # randomly assign validator node
-        self.validator_node_id = random.randint(0, len(self.nodes)-1)
+        super().assign_nodes(nodes)
+        if self.stakes is None:
+            self.stakes = Stakes(np.ones(len(self.nodes)), self.rng.validator)
+        self.validator_blocks = np.zeros(len(self.nodes), dtype=np.int64) # blocks proposed by each node
+        self.validator_txns = np.zeros(len(self.nodes), dtype=np.int64) # transactions in the blocks each node proposed
+
+    def validator(self, node):
+        """
+        Id of the node that proposes the next block on the given node's chain.  Only that node makes the block, so
+        the validator's own chain is never behind
+        """
+        if not self.epoch_length:
+            return self.stakes.proposer(0)
+        height = node.ledger.tip_height() + 1
+        return self.stakes.proposer((height - 1) // self.epoch_length)
 
     def add_transaction(self, txn, sending_node_id):
         """
-        Sends a new transaction to the validator node
+        Sends a new transaction to the validator node, or to every node when validators rotate
         """
-        validator_node = self.nodes[self.validator_node_id]
+        if self.broadcasts_transactions:
+            self.broadcast_transaction(txn, sending_node_id)
+            return
+        validator_id = self.stakes.proposer(0)
         # don't need to send the sender the transaction it is sending out
-        if sending_node_id == validator_node.id:
-            if self.time not in self.incoming_messages[validator_node.id]:
-                self.incoming_messages[validator_node.id][self.time] = []
-            self.incoming_messages[validator_node.id][self.time].append((txn, TRANSACTION, sending_node_id))
+        if sending_node_id == validator_id:
+            self.deliver(validator_id, self.time, (txn, TRANSACTION, sending_node_id))
             return
-        
+
         # sending to validator node
-        assert validator_node.id in self.incoming_messages, f"node-{validator_node.id} is not in the dictionary storing queues for nodes"
-        delay = self.latency_fn(sending_node_id, self.validator_node_id)
-        additional_delay = self.get_additional_delay(sending_node_id, self.validator_node_id)
+        delay = self.latency_fn(sending_node_id, validator_id)
+        additional_delay = self.links.delay(self.time, sending_node_id, validator_id, message_size(txn, TRANSACTION), TRANSACTION)
         future_time = self.time + delay + additional_delay
-        if future_time not in self.incoming_messages[validator_node.id]:
-            self.incoming_messages[validator_node.id][future_time] = []
-        self.incoming_messages[validator_node.id][future_time].append((txn, TRANSACTION, sending_node_id))
+        self.deliver(validator_id, future_time, (txn, TRANSACTION, sending_node_id))
         self.packets_sent += 1
-        # # reasseign validator node
-        # self.validator_node_id = random.randint(0, len(self.nodes) -1)
+        self.log.write(SENT, self.time, sending_node_id, 1, TRANSACTION_PACKET)
 
-    def tick(self):
+    def receive(self, node, verified_blocks, transactions):
+        """
+        Adds incoming blocks to the node's chain and queues incoming transactions, and has the node propose the
+        next block if it is the validator
+        """
+        for pkt, sender_id in sorted(verified_blocks, key=lambda x: x[0].block_id):
+            node.add_block(pkt)
+            self.links.delivered(sender_id, node.id)
+        for pkt, sender_id in transactions:
+            node.ledger.add_incoming_txn(pkt, self.time)
+            self.links.delivered(sender_id, node.id)
+        # a block can start the node's epoch, with the transactions it already holds
+        if node.id == self.validator(node):
+            ready = node.ledger.batch_ready_time(self.time)
+            if ready is not None:
+                self.schedule_mine(node.id, ready)
+
+    def mine(self, node):
         """
-        Runs computations on each node for one "time" tick
-        """
-        ind = self.check_for_majority()
-        consensus_ind = self.check_for_consensus()
-        self.calculate_latency(ind)
-        self.calculate_consensus(consensus_ind)
-
-        # termination condition
-        if consensus_ind == self.last_block_id:
-            print(f"Latencies: {self.latencies}\nConsensus: {self.consensus_times}\nNumber of Computations: {self.num_computations}\nPackets Sent {self.packets_sent}")
-            return self.latencies, self.consensus_times, self.num_computations, self.packets_sent
-
-        self.apply_actions()     
-
-        for node in self.nodes:
-            # node checks if it has any actions at this time (send txn or add block) -- incoming messages
-            incoming_packets = self.search_for_txns(node.id, self.time)
-            verified_blocks, transactions = self.seperate_packets(incoming_packets)
-            for pkt, sender_id in sorted(verified_blocks, key=lambda x: x[0].block_id):
-                node.add_block(pkt)
-                self.remove_from_transit(sender_id, node.id)
-            for pkt, sender_id in transactions:
-                node.ledger.add_incoming_txn(pkt)
-                self.remove_from_transit(sender_id, node.id)
-        
-        # validator node needs to mine block if there are awaiting transactions
-        validator_node = self.nodes[self.validator_node_id]
-        res = validator_node.mine_pos()
+        Validator node needs to mine block if there are awaiting transactions
+        """
+        res = node.mine_pos(self.time)
         # successful mined block
         if res is not None:
             new_block, num_computations = res
             self.num_computations += num_computations
-            self.broadcast_block(new_block, self.validator_node_id)
-        self.time += 1 
\ No newline at end of file
+            self.record_block(new_block)
+            self.log.write(MINED, self.time, node.id, new_block.block_id, num_computations)
+            self.broadcast_block(new_block, node.id)
+            self.validator_blocks[node.id] += 1
+            self.validator_txns[node.id] += len(new_block.data)
+        # once its epoch is over, the next validator picks up from the transactions it holds itself
+        if node.id == self.validator(node):
+            ready = node.ledger.batch_ready_time(self.time + 1)
+            if ready is not None:
+                self.schedule_mine(node.id, ready)
+
+    def load_counters(self):
+        return {
+            "validator_blocks": self.validator_blocks,
+            "validator_txns": self.validator_txns,
+        }
+
+    def summary(self):
+        """
+        Adds how the blocks and their transactions were spread across the validators
+        """
+        summary = super().summary()
+        proposed = np.flatnonzero(self.validator_blocks)
+        summary.update({
+            "num_validators": len(proposed),
+            "max_validator_blocks": int(self.validator_blocks.max(initial=0)),
+            "max_validator_txns": int(self.validator_txns.max(initial=0)),
+            # node id -> blocks and transactions proposed, for every node that proposed a block
+            "validator_blocks": {str(i): int(self.validator_blocks[i]) for i in proposed},
+            "validator_txns": {str(i): int(self.validator_txns[i]) for i in proposed},
+        })
+        return summary
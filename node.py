@@ -2,22 +2,30 @@
 Class that represents a user on the Bitcoin network
 """
 
-from util import generate_keys
 from blockchain import Blockchain
-from util import generate_keys
+from constants import BLOCK_SIZE, DIFFICULTY, HASH_RATE
+from keystore import LazyKeys
 
 class Node:
-    def __init__(self, id, net, genesis_block):
+    def __init__(self, id, net, genesis_block, difficulty=DIFFICULTY, hash_rate=HASH_RATE, keys=None, mempool_capacity=None, rng=None, block_size=BLOCK_SIZE, block_bytes=None, block_wait=0, table=None):
         self.id = id
-        self.public_key, self.private_key = generate_keys()
-        self.ledger = Blockchain(genesis_block)
+        self.keys = keys if keys is not None else LazyKeys() # only creates this node's keys once they are used
+        self.ledger = Blockchain(genesis_block, difficulty=difficulty, hash_rate=hash_rate, mempool_capacity=mempool_capacity, rng=rng, block_size=block_size, block_bytes=block_bytes, block_wait=block_wait, table=table)
         self.net = net
 
-    def mine(self):
-        return self.ledger.mine()
+    @property
+    def public_key(self):
+        return self.keys.get(self.id)[0]
 
-    def mine_pos(self):
-        return self.ledger.mine_pos()
+    @property
+    def private_key(self):
+        return self.keys.get(self.id)[1]
+
+    def mine(self, timestamp):
+        return self.ledger.mine(timestamp)
+
+    def mine_pos(self, timestamp):
+        return self.ledger.mine_pos(timestamp)
 
     def add_block(self, block):
         return self.ledger.add_block(block)
@@ -0,0 +1,549 @@
+"""
+Runs one simulation across several worker processes, each simulating a share of the nodes, with exactly the results
+of running it in one process.  Conservative parallel discrete event simulation: no packet arrives sooner than the
+minimum latency (the lookahead) after it is sent, so each worker simulates a window of that many ms on its own, and
+the packets its nodes sent to other partitions are handed over in one batch at the barrier after the window.
+
+Every worker keeps all of the nodes and processes every action of the schedule, so transaction ids mean the same
+thing everywhere, but only sends from, delivers to and mines on the nodes it owns.  Blocks made in a window are added
+to every worker's block table at the barrier, before any packet can carry them to another partition.  What depends
+on the order of events across nodes (the event log, when transactions reach a majority or all nodes, block
+propagation times, queue depths, mempool samples) is journaled by the workers under the position of the event that
+caused it in the serial run, (time, phase, node or action, sequence number), and replayed by the coordinator in that
+order.  The coordinator notices that the run is over after the window it ends in, so workers keep a snapshot of the
+start of windows the run could end in and redo them up to the last time step
+"""
+import heapq
+import multiprocessing
+import pickle
+import traceback
+from bisect import bisect_left
+
+import numpy as np
+
+from constants import ACTION, BLOCK, DELIVERY
+from eventlog import MEMPOOL, SUBMITTED
+from inbox import Mailbox
+from links import BandwidthModel
+
+
+class JournalSink:
+    """
+    Event log of a partition, which keeps every record under the position of the event that wrote it so the
+    coordinator can write them in order.  Records of the skipped kind are dropped but still take up a position
+    """
+    def __init__(self, net, skip=None):
+        self.net = net
+        self.skip = skip
+
+    def write(self, kind, time, *values):
+        key = self.net.next_key()
+        if kind != self.skip:
+            self.net.journal.append((key, "log", (kind, time) + values))
+
+    def flush(self):
+        pass
+
+    def position(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class JournalTracker:
+    """
+    Stands in for the confirmation tracker in a partition: confirmations are journaled for the coordinator, which counts
+    them across every partition
+    """
+    def __init__(self, net):
+        self.net = net
+
+    def confirm(self, txn_ids):
+        self.net.journal.append((self.net.next_key(), "confirm", np.asarray(txn_ids).tolist()))
+
+    def unconfirm(self, txn_ids):
+        self.net.journal.append((self.net.next_key(), "unconfirm", np.asarray(txn_ids).tolist()))
+
+
+class OrderedMailbox(Mailbox):
+    """
+    Mailbox of a partition.  Packets from other partitions are put in at barriers, after packets that were sent
+    later in the serial run, so every packet carries the position it was sent at and the packets of each arrival
+    time are sorted by it.  Queue depths are worked out after each window from a log of when packets were sent and
+    delivered, since packets from other partitions only show up at the barrier
+    """
+    def __init__(self, num_nodes):
+        super().__init__(num_nodes)
+        self.puts = [] # (time sent, whether an action sent it, receiving node ids) since the depths were last settled
+        self.pops = [] # (time delivered, receiving node ids) since the depths were last settled
+
+    def put(self, time, node_ids, packet, key):
+        new_slot = time not in self.slots
+        if new_slot:
+            self.slots[time] = []
+        self.slots[time].append((key, node_ids, packet))
+        self.pending += len(node_ids)
+        self.account(key, node_ids)
+        return new_slot
+
+    def account(self, key, node_ids):
+        """
+        Logs a packet sent at the given position to the given nodes, for the queue depths
+        """
+        self.puts.append((key[0], key[1] == ACTION, node_ids))
+
+    def pop(self, time):
+        entries = self.slots.pop(time, [])
+        entries.sort(key=lambda entry: entry[0])
+        batches = []
+        for _, node_ids, packet in entries:
+            self.pending -= len(node_ids)
+            self.delivered += len(node_ids)
+            self.pops.append((time, node_ids))
+            batches.append((node_ids, packet))
+        return batches
+
+    def settle_depth(self):
+        """
+        Moves the queue depth of every node, and the peak depth, forward over the logged sends and deliveries.  Within
+        a time step actions send before the deliveries and everything else sends after them, so the peak of a node in
+        a step is its depth after the actions or at the end of the step
+        """
+        logged = [(t, 0 if action else 2, ids) for t, action, ids in self.puts] + [(t, 1, ids) for t, ids in self.pops]
+        self.puts = []
+        self.pops = []
+        if not logged:
+            return
+        sizes = [len(ids) for _, _, ids in logged]
+        nodes = np.concatenate([np.asarray(ids, dtype=np.int64) for _, _, ids in logged])
+        times = np.repeat(np.array([t for t, _, _ in logged], dtype=np.int64), sizes)
+        phases = np.repeat(np.array([phase for _, phase, _ in logged], dtype=np.int64), sizes)
+        order = np.lexsort((times, nodes))
+        nodes, times, phases = nodes[order], times[order], phases[order]
+        starts = np.flatnonzero(np.r_[True, (nodes[1:] != nodes[:-1]) | (times[1:] != times[:-1])])
+        sent_by_actions = np.add.reduceat((phases == 0).astype(np.int64), starts)
+        delivered = np.add.reduceat((phases == 1).astype(np.int64), starts)
+        sent_after = np.add.reduceat((phases == 2).astype(np.int64), starts)
+        nodes = nodes[starts]
+        change = sent_by_actions - delivered + sent_after
+        # depth of each node before each of its steps
+        first = np.r_[True, nodes[1:] != nodes[:-1]]
+        before = np.cumsum(change) - change
+        before = self.depth[nodes] + before - before[first][np.cumsum(first) - 1]
+        peak = before + sent_by_actions + np.maximum(sent_after - delivered, 0)
+        self.peak_depth = max(self.peak_depth, int(peak.max()))
+        np.add.at(self.depth, nodes, change)
+
+
+class Partition:
+    """
+    Mixed into a protocol's network class to simulate the nodes of one partition
+    """
+    def partition(self, index, num_partitions):
+        """
+        Makes this network simulate only the nodes whose id is index modulo num_partitions
+        """
+        self.partition_index = index
+        self.num_partitions = num_partitions
+        self.owner = np.arange(len(self.nodes)) % num_partitions # partition of every node
+        self.owned = (self.owner == index).tolist()
+        self.event = (0, ACTION, 0) # position of the event being processed
+        self.seq = 0
+        self.window_end = 0
+        self.journal = [] # (position, kind of entry, value) for the coordinator to replay
+        self.outbox = [] # (arrival time, node ids, packet, position it was sent at) for nodes of other partitions
+        self.new_blocks = [] # (position, block) of the blocks made in this window
+        self.steps = [] # every time step processed in this window
+        self.step_counts = [] # (time, packets sent by actions, packets sent later, packets delivered) of each step
+        self.samples = [] # (time, total, largest mempool size) before the first step past each sampling time
+        self.log = JournalSink(self, SUBMITTED)
+        self.tracker = JournalTracker(self)
+        for n in self.nodes:
+            n.ledger.track(self.tracker)
+        self.incoming_messages = OrderedMailbox(len(self.nodes))
+
+    def owns(self, node_id):
+        # senders outside the network are split across partitions like nodes
+        if node_id >= len(self.owned):
+            return node_id % self.num_partitions == self.partition_index
+        return self.owned[node_id]
+
+    def begin_event(self, kind, index):
+        self.event = (self.time, kind, index)
+
+    def next_key(self):
+        self.seq += 1
+        return self.event + (self.seq,)
+
+    def deliver_many(self, node_ids, future_time, packet):
+        key = self.next_key()
+        self.step_sent[self.event[1] != ACTION] += len(node_ids)
+        local = [i for i in node_ids if self.owned[i]]
+        if local and self.incoming_messages.put(future_time, local, packet, key):
+            self.events.push(future_time, DELIVERY)
+        if len(local) < len(node_ids):
+            self.outbox.append((future_time, [i for i in node_ids if not self.owned[i]], packet, key))
+
+    def record_block(self, block):
+        super().record_block(block)
+        key = self.next_key()
+        self.journal.append((key, "block", block.block_hash))
+        self.new_blocks.append((key, block))
+
+    def block_arrived(self, block_hash):
+        self.journal.append((self.next_key(), "arrive", block_hash))
+
+    def mempool_sizes(self):
+        sizes = [len(n.ledger.unconfirmed_txns) for n in self.nodes]
+        return sum(sizes), max(sizes, default=0)
+
+    def receive_remote(self, blocks, packets):
+        """
+        Adds the blocks made by other partitions in the last window, in the order they were made, and queues the
+        packets other partitions sent to this one's nodes
+        """
+        for block in blocks:
+            self.table.add(block)
+        for future_time, node_ids, packet, key in packets:
+            if future_time < self.window_end:
+                raise Exception(f"Packet sent at {key[0]} arrives at {future_time}, inside the window that ended at {self.window_end}")
+            pkt, pkt_type, _ = packet
+            if pkt_type == BLOCK:
+                # rows differ between partitions
+                pkt.index = self.table.rows[pkt.block_hash]
+            if self.incoming_messages.put(future_time, node_ids, packet, key):
+                self.events.push(future_time, DELIVERY)
+        self.incoming_messages.settle_depth()
+
+    def run_window(self, end):
+        """
+        Processes every event before the end of the window
+        """
+        self.window_end = end
+        while True:
+            next_time = self.events.peek_time()
+            if next_time is None or next_time >= end:
+                break
+            if next_time >= self.next_sample:
+                self.samples.append((next_time,) + self.mempool_sizes())
+                self.next_sample = (next_time // self.sample_interval + 1) * self.sample_interval
+            self.time = next_time
+            self.step_sent = [0, 0]
+            delivered = self.incoming_messages.delivered
+            self.tick()
+            self.steps.append(next_time)
+            counts = (next_time, self.step_sent[0], self.step_sent[1], self.incoming_messages.delivered - delivered)
+            if any(counts[1:]):
+                self.step_counts.append(counts)
+        self.samples.append((end,) + self.mempool_sizes())
+
+    def take_window(self):
+        """
+        Hands over everything the coordinator needs from the last window
+        """
+        window = {
+            "steps": self.steps,
+            "journal": self.journal,
+            "outbox": self.outbox,
+            "new_blocks": self.new_blocks,
+            "step_counts": self.step_counts,
+            "samples": self.samples,
+            "next_time": self.events.peek_time(),
+        }
+        self.steps, self.journal, self.outbox, self.new_blocks, self.step_counts, self.samples = [], [], [], [], [], []
+        return window
+
+    def final_stats(self):
+        """
+        Counters of this partition's nodes, to be combined across partitions
+        """
+        stats = {
+            "num_computations": self.num_computations,
+            "packets_sent": self.packets_sent,
+            "duplicate_packets": self.duplicate_packets,
+            "blocks_mined": self.blocks_mined,
+            "chain": self.chain_stats(),
+            # rows differ between the block tables of the partitions, hashes don't
+            "chain_hashes": self.chain_hashes(),
+            "mempool": self.mempool_stats(),
+            "pending": self.incoming_messages.pending,
+            "delivered": self.incoming_messages.delivered,
+            "peak_depth": self.incoming_messages.peak_depth,
+            "links": None,
+            "load": self.load_counters(),
+        }
+        if isinstance(self.links, BandwidthModel):
+            stats["links"] = (self.links.bytes_sent, self.links.packets, self.links.waits, self.links.max_wait)
+        return stats
+
+
+def partition_class(cls, mixin):
+    """
+    Subclass of a protocol's network class with the given mixin, kept as a module attribute so that its instances
+    can be pickled
+    """
+    name = f"{mixin.__name__}{cls.__name__}"
+    if name not in globals():
+        globals()[name] = type(name, (mixin, cls), {})
+    return globals()[name]
+
+
+def work(conn, create_network, args, index, num_partitions):
+    """
+    Worker process simulating one partition, driven by the coordinator over conn
+    """
+    try:
+        net = create_network(args)
+        net.__class__ = partition_class(type(net), Partition)
+        net.partition(index, num_partitions)
+        conn.send(net.events.peek_time())
+        snapshot = None
+        while True:
+            message = conn.recv()
+            if message[0] == "window":
+                _, end, blocks, packets, keep = message
+                net.receive_remote(blocks, packets)
+                snapshot = pickle.dumps(net, pickle.HIGHEST_PROTOCOL) if keep else None
+                net.run_window(end)
+                conn.send(net.take_window())
+            elif message[0] == "stop":
+                # redo the last window up to the end of the run
+                if snapshot is not None:
+                    net = pickle.loads(snapshot)
+                    net.log = JournalSink(net, SUBMITTED)
+                net.run_window(message[1])
+                conn.send([(key, node_ids) for _, node_ids, _, key in net.take_window()["outbox"]])
+            elif message[0] == "finish":
+                # packets other partitions sent in the last window only count towards the queue depths
+                for key, node_ids in message[1]:
+                    net.incoming_messages.account(key, node_ids)
+                net.incoming_messages.settle_depth()
+                conn.send(net.final_stats())
+                return
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+
+
+class Coordinator:
+    """
+    Mixed into a protocol's network class to run it across worker processes.  The coordinator simulates no nodes
+    itself: it submits the schedule's transactions, replays the workers' journals in serial order to keep the log,
+    the latencies and the termination check, and routes packets and blocks between partitions at every barrier
+    """
+    def coordinate(self, create_network, args, num_partitions, lookahead):
+        """
+        Settings of the run, kept until it starts
+        """
+        self.create_network = create_network
+        self.args = args
+        self.num_partitions = num_partitions
+        self.lookahead = lookahead
+        self.owner = np.arange(len(self.nodes)) % num_partitions
+        self.event = (0, ACTION, 0)
+        self.journal = []
+        self.step_pending = 0 # packets in flight across all partitions at the end of the last replayed step
+        self.combined = None
+
+    def owns(self, node_id):
+        return False
+
+    def begin_event(self, kind, index):
+        self.event = (self.time, kind, index)
+
+    def next_key(self):
+        # submissions come before everything their action sends
+        return self.event + (-1,)
+
+    def run(self):
+        context = multiprocessing.get_context()
+        pipes, workers = [], []
+        for i in range(self.num_partitions):
+            parent, child = context.Pipe()
+            worker = context.Process(target=work, args=(child, self.create_network, self.args, i, self.num_partitions), daemon=True)
+            worker.start()
+            pipes.append(parent)
+            workers.append(worker)
+        try:
+            summary = self.run_partitions(pipes)
+        except BaseException:
+            for worker in workers:
+                worker.terminate()
+            raise
+        for worker in workers:
+            worker.join()
+        return summary
+
+    def gather(self, pipes):
+        replies = [pipe.recv() for pipe in pipes]
+        for reply in replies:
+            if isinstance(reply, tuple) and reply[0] == "error":
+                raise Exception(f"Partition failed:\n{reply[1]}")
+        return replies
+
+    def run_partitions(self, pipes):
+        next_times = self.gather(pipes)
+        routes = [[] for _ in pipes]
+        blocks = []
+        stop = self.check(-1)
+        while stop is None:
+            starts = [t for t in next_times if t is not None] + [packet[0] for route in routes for packet in route]
+            if not starts:
+                raise Exception(f"No pending events at time {self.time} but not all transactions have been verified")
+            end = min(starts) + self.lookahead
+            # the run can only end once the schedule has run out
+            next_action = self.events.peek_time()
+            keep = next_action is None or next_action < end
+            for i, pipe in enumerate(pipes):
+                pipe.send(("window", end, [block for origin, block in blocks if origin != i], routes[i], keep))
+            windows = self.gather(pipes)
+            stop = self.replay(windows)
+            routes = [[] for _ in pipes]
+            for window in windows:
+                for future_time, node_ids, packet, key in window["outbox"]:
+                    for owner, group in self.split(node_ids):
+                        routes[owner].append((future_time, group, packet, key))
+            made = heapq.merge(*[[(key, i, block) for key, block in window["new_blocks"]] for i, window in enumerate(windows)])
+            blocks = [(origin, block) for _, origin, block in made]
+            next_times = [window["next_time"] for window in windows]
+
+        for pipe in pipes:
+            pipe.send(("stop", stop + 1))
+        outboxes = self.gather(pipes)
+        puts = [[] for _ in pipes]
+        in_flight = 0
+        for outbox in outboxes:
+            for key, node_ids in outbox:
+                in_flight += len(node_ids)
+                for owner, group in self.split(node_ids):
+                    puts[owner].append((key, group))
+        for pipe, partition_puts in zip(pipes, puts):
+            pipe.send(("finish", partition_puts))
+        self.combine(self.gather(pipes), in_flight)
+        self.time = stop + 1
+        return self.finish()
+
+    def split(self, node_ids):
+        """
+        Groups node ids by the partition that owns them
+        """
+        owners = self.owner[node_ids]
+        if (owners == owners[0]).all():
+            return [(int(owners[0]), node_ids)]
+        return [(int(owner), [i for i, o in zip(node_ids, owners.tolist()) if o == owner]) for owner in np.unique(owners)]
+
+    def check(self, step):
+        """
+        Termination check after the given time step.  Returns the step if the run is over
+        """
+        self.time = step + 1
+        self.calculate_latency(self.check_for_majority())
+        self.calculate_consensus(self.check_for_consensus())
+        if self.schedule_done and not self.start_times:
+            return step
+        return None
+
+    def replay(self, windows):
+        """
+        Replays one window of every partition in serial order.  Returns the last time step if the run ended in it
+        """
+        steps = sorted(set().union(*(window["steps"] for window in windows)))
+        journal = heapq.merge(*(window["journal"] for window in windows), key=lambda entry: entry[0])
+        upcoming = next(journal, None)
+        sample_times = [[sample[0] for sample in window["samples"]] for window in windows]
+        counts = {}
+        for window in windows:
+            for t, *sent_and_delivered in window["step_counts"]:
+                total = counts.setdefault(t, [0, 0, 0])
+                for i, value in enumerate(sent_and_delivered):
+                    total[i] += value
+
+        for step in steps:
+            if step >= self.next_sample:
+                samples = [window["samples"][bisect_left(times, step)] for window, times in zip(windows, sample_times)]
+                self.log.write(MEMPOOL, self.time, sum(s[1] for s in samples), max(s[2] for s in samples))
+                self.next_sample = (step // self.sample_interval + 1) * self.sample_interval
+            self.time = step
+            # the coordinator's own submissions at this step, in their place among the workers' entries
+            entries = []
+            if self.events.peek_time() == step:
+                self.events.pop()
+                sink, self.log = self.log, JournalSink(self)
+                self.apply_actions()
+                self.log = sink
+                entries, self.journal = self.journal, []
+            while upcoming is not None and upcoming[0][0] == step:
+                entries.append(upcoming)
+                upcoming = next(journal, None)
+            entries.sort(key=lambda entry: entry[0])
+            for _, kind, value in entries:
+                if kind == "log":
+                    self.log.write(*value)
+                elif kind == "confirm":
+                    self.tracker.confirm(value)
+                elif kind == "unconfirm":
+                    self.tracker.unconfirm(value)
+                elif kind == "block":
+                    if len(self.nodes) > 1:
+                        self.block_sent[value] = (step, 0)
+                elif kind == "arrive":
+                    self.block_arrived(value)
+
+            by_actions, after, delivered = counts.get(step, (0, 0, 0))
+            pending = self.incoming_messages.peak_pending
+            self.incoming_messages.peak_pending = max(pending, self.step_pending + by_actions + max(after - delivered, 0))
+            self.step_pending += by_actions + after - delivered
+            if self.check(step) is not None:
+                return step
+        return None
+
+    def combine(self, stats, in_flight):
+        """
+        Combines the counters of every partition
+        """
+        self.num_computations = sum(s["num_computations"] for s in stats)
+        self.packets_sent = sum(s["packets_sent"] for s in stats)
+        self.duplicate_packets = sum(s["duplicate_packets"] for s in stats)
+        self.blocks_mined = sum(s["blocks_mined"] for s in stats)
+        for name in stats[0]["load"]:
+            setattr(self, name, sum(s["load"][name] for s in stats))
+        self.combined = {
+            "chain": {
+                "tip_height": max(s["chain"]["tip_height"] for s in stats),
+                # a block can be on the chains of nodes in several partitions
+                "on_chain": len(np.unique(np.concatenate([s["chain_hashes"] for s in stats]))),
+                "reorgs": sum(s["chain"]["reorgs"] for s in stats),
+                "max_reorg_depth": max(s["chain"]["max_reorg_depth"] for s in stats),
+            },
+            "mempool": {
+                "peak_mempool_size": max(s["mempool"]["peak_mempool_size"] for s in stats),
+                "deferred_txns": sum(s["mempool"]["deferred_txns"] for s in stats),
+            },
+        }
+        mailbox = self.incoming_messages
+        mailbox.pending = sum(s["pending"] for s in stats) + in_flight
+        mailbox.delivered = sum(s["delivered"] for s in stats)
+        mailbox.peak_depth = max(s["peak_depth"] for s in stats)
+        if isinstance(self.links, BandwidthModel):
+            self.links.bytes_sent = sum(s["links"][0] for s in stats)
+            self.links.packets = sum(s["links"][1] for s in stats)
+            # every sender's waits add up in one partition
+            self.links.waits = sum(s["links"][2] for s in stats)
+            self.links.max_wait = max(s["links"][3] for s in stats)
+
+    def chain_stats(self):
+        return self.combined["chain"]
+
+    def mempool_stats(self):
+        return self.combined["mempool"]
+
+
+def partitioned_network(create_network, args, num_partitions, lookahead):
+    """
+    Network that runs the experiment described by args across num_partitions worker processes, exchanging packets
+    every lookahead ms
+    """
+    net = create_network(args)
+    net.__class__ = partition_class(type(net), Coordinator)
+    net.coordinate(create_network, args, num_partitions, lookahead)
+    return net
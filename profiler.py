@@ -0,0 +1,97 @@
+"""
+Wall-clock instrumentation of a simulation run: cumulative time and number of calls of every phase of the event
+loop (termination checks, actions, deliveries, mining, broadcasts, ...), and the peak sizes of the event queue,
+mailbox and mempools.  Phases nest, so a broadcast made while mining counts towards both
+"""
+import time
+
+
+class NullTimer:
+    # stands in for every phase when profiling is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class NullProfiler:
+    """
+    Profiler that records nothing, used unless profiling is turned on
+    """
+    def begin(self, sim_time):
+        pass
+
+    def phase(self, name):
+        return NULL_TIMER
+
+    def peak(self, name, value):
+        pass
+
+
+class PhaseTimer:
+    """
+    Adds the wall time of every with block it is used in to one phase
+    """
+    __slots__ = ("seconds", "calls", "start")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.start
+        self.calls += 1
+        return False
+
+
+class Profiler:
+    """
+    Records the wall time of each phase and the peak value of each sampled size
+    """
+    def __init__(self):
+        self.timers = {} # maps from phase name to its timer
+        self.peaks = {} # maps from a sampled size to the largest value seen
+        self.wall_start = time.perf_counter()
+        self.sim_start = None # simulated time when the run started, which is later than 0 after resuming
+
+    def begin(self, sim_time):
+        if self.sim_start is None:
+            self.sim_start = sim_time
+            self.wall_start = time.perf_counter()
+
+    def phase(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = PhaseTimer()
+        return timer
+
+    def peak(self, name, value):
+        if value > self.peaks.get(name, 0):
+            self.peaks[name] = value
+
+    def report(self, net):
+        """
+        Machine readable summary of where the run spent its time
+        """
+        wall = time.perf_counter() - self.wall_start
+        simulated = net.time - (self.sim_start or 0)
+        return {
+            "protocol": type(net).__name__,
+            "wall_seconds": wall,
+            "simulated_ms": simulated,
+            "simulated_ms_per_wall_second": simulated / wall if wall else 0,
+            "phases": {
+                name: {"seconds": timer.seconds, "calls": timer.calls, "share": timer.seconds / wall if wall else 0}
+                for name, timer in sorted(self.timers.items(), key=lambda item: -item[1].seconds)
+            },
+            "peaks": self.peaks,
+        }
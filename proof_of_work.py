@@ -0,0 +1,51 @@
+"""
+Deterministic proof of work backend.  Block headers are hashed with SHA-256, and nonces are checked in batches
+against a difficulty target so the cost of finding a block only depends on the difficulty
+"""
+import hashlib
+
+import numpy as np
+
+HASH_BYTES = 8 # number of leading digest bytes that make up the hash value of a block
+BATCH_SIZE = 1024 # number of nonces hashed before checking the batch against the target
+
+
+def target_for(difficulty):
+    """
+    Returns the hash value a block must fall under so that a single nonce succeeds with probability 1/difficulty
+    """
+    return (1 << (8 * HASH_BYTES)) // difficulty
+
+
+def digest(header, nonce):
+    """
+    Hash value of the block header with the given nonce
+    """
+    h = hashlib.sha256(header)
+    h.update(int(nonce).to_bytes(8, 'big'))
+    return int.from_bytes(h.digest()[:HASH_BYTES], 'big')
+
+
+def search_nonce(header, start_nonce, target):
+    """
+    Tries consecutive nonces starting at start_nonce until the hash of the header falls under the target
+
+    Input: header bytes shared by every attempt, first nonce to try, target hash value
+    Output: (solving nonce, hash value, number of hashes computed)
+    """
+    prefix = hashlib.sha256(header)
+    tries = 0
+    while True:
+        nonces = np.arange(start_nonce + tries, start_nonce + tries + BATCH_SIZE, dtype='>u8')
+        raw = nonces.tobytes()
+        digests = bytearray()
+        for i in range(0, len(raw), 8):
+            h = prefix.copy()
+            h.update(raw[i:i+8])
+            digests += h.digest()[:HASH_BYTES]
+        values = np.frombuffer(bytes(digests), dtype='>u8')
+        hits = np.flatnonzero(values < target)
+        if len(hits):
+            i = int(hits[0])
+            return int(nonces[i]), int(values[i]), tries + i + 1
+        tries += BATCH_SIZE
@@ -0,0 +1,84 @@
+"""
+Merges the metrics of replicate runs of one configuration, which only differ by their seed, into means with 95%
+confidence intervals.  Latency sketches are merged exactly, so the merged percentiles are those of every
+transaction across all of the replicates
+"""
+import math
+import numbers
+
+from sketch import QuantileSketch
+
+# two-sided 95% critical values of Student's t distribution by degrees of freedom, then for larger samples
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+        2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+T_95_LARGE = [(40, 2.021), (60, 2.000), (120, 1.980), (1000, 1.962)]
+SKETCHES = {"latency_sketch": "latency_percentiles", "consensus_sketch": "consensus_percentiles"} # sketch -> its percentiles
+
+
+def t_critical(df):
+    """
+    Two-sided 95% critical value of Student's t distribution, rounded down to the nearest tabulated degrees of freedom
+    """
+    if df <= len(T_95):
+        return T_95[df - 1]
+    value = T_95[-1]
+    for at_least, t in T_95_LARGE:
+        if df >= at_least:
+            value = t
+    return value
+
+
+def interval(values):
+    """
+    Mean, sample standard deviation and 95% confidence interval of the mean of the given values
+    """
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return {"n": n, "mean": mean, "std": 0.0, "ci_low": mean, "ci_high": mean}
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    half = t_critical(n - 1) * std / math.sqrt(n)
+    return {"n": n, "mean": mean, "std": std, "ci_low": mean - half, "ci_high": mean + half}
+
+
+def is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def merge_values(values):
+    """
+    Means and intervals of one metric across replicates, recursing into dictionaries of metrics.  Returns
+    (mean, interval), which are None for metrics that aren't numbers in every replicate
+    """
+    if all(is_number(v) for v in values):
+        stats = interval(values)
+        return stats["mean"], stats
+    if all(isinstance(v, dict) for v in values):
+        means, intervals = {}, {}
+        for key in values[0]:
+            if all(key in v for v in values):
+                means[key], intervals[key] = merge_values([v[key] for v in values])
+        return means, intervals
+    return None, None
+
+
+def merge(runs):
+    """
+    Merges the metrics of every replicate.  Returns (metrics, intervals): the metrics have the same keys as a
+    single run's, holding means (and percentiles of the merged sketches), and the intervals hold the mean, standard
+    deviation and confidence interval of every numeric metric
+    """
+    metrics, intervals = {}, {}
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        if key in SKETCHES:
+            sketch = QuantileSketch.from_dict(values[0])
+            for value in values[1:]:
+                sketch.merge(QuantileSketch.from_dict(value))
+            metrics[key] = sketch.to_dict()
+            continue
+        metrics[key], intervals[key] = merge_values(values)
+    for key, percentiles in SKETCHES.items():
+        if key in metrics and percentiles in metrics:
+            metrics[percentiles] = QuantileSketch.from_dict(metrics[key]).percentiles()
+    return metrics, intervals
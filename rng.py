@@ -0,0 +1,34 @@
+"""
+Independent random number streams for each part of the simulation, all derived from one seed so that a run can be
+reproduced exactly
+"""
+import numpy as np
+
+STREAMS = ("latency", "congestion", "nonce", "validator", "workload", "topology")
+
+
+class RandomStreams:
+    """
+    One numpy Generator per subsystem: link latencies, congestion delays, initial block nonces, validator
+    selection, generated workloads and gossip peer graphs.  Drawing more numbers from one stream never changes the numbers drawn from another
+    """
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.entropy = np.random.SeedSequence(seed).entropy # recreates the same streams when there is no seed
+        children = np.random.SeedSequence(self.entropy).spawn(len(STREAMS))
+        for name, child in zip(STREAMS, children):
+            setattr(self, name, np.random.default_rng(child))
+
+    def per_node(self, name, num_nodes):
+        """
+        One generator of the named subsystem for each node, so what a node draws doesn't depend on what the other
+        nodes drew before it
+        """
+        return [self.node_stream(name, i) for i in range(num_nodes)]
+
+    def node_stream(self, name, i):
+        """
+        Generator of the named subsystem for node i, which is the same no matter when or how often it is made
+        """
+        stream = STREAMS.index(name)
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=(stream, i)))
@@ -6,20 +6,73 @@ Usage:
     ARGS:
         --type (what type of consensus protocol to run: proof_of_work (pow), proof_of_stake (pos), or centralized (c))
         --nodes (number of nodes to run experiment with)
-        --schedule (file name of the schedule that will run in a format that has time stamp mapped to a list of transactions
-                    that will happen)
+        --schedule (name of the schedule in /schedules that will run: a .json file mapping each time stamp to a list of
+                    transactions, a time sorted .jsonl file of [time, sender, data] lines, or a .npy file of times and
+                    senders; "poisson" generates a workload instead)
+        --tps / --txns (rate and number of transactions of a generated workload)
+        --senders / --zipf-exponent (how the senders of a generated workload are distributed: uniform or zipf)
         --topo (topology to use; equadistant sets all nodes an equal distance apart)
+        --difficulty (expected number of hashes to mine a proof of work block)
+        --hash-rate (hashes each node computes per simulated millisecond in proof of work)
+        --keys (how node keys are created: lazy, keystore or deterministic)
+        --mempool-capacity (most unconfirmed transactions a node can make blocks from at once; more wait their turn)
+        --block-size / --block-bytes (most transactions / bytes of transactions in one block)
+        --block-wait (longest a transaction waits, in ms, for a block to fill up before it is mined anyway)
+        --relay (how blocks and proof of work transactions are broadcast: flood sends them straight to every node, gossip
+                 relays them along a random peer graph)
+        --degree / --seen-cache (average number of peers of a node, and recent messages each node remembers before asking
+                              its ledger, with gossip; at least the number of peers of any node)
+        --link-model (how long packets wait before their latency: uplink queues each node's packets on one uplink,
+                      link on one queue per receiver, congestion is the original random delay)
+        --bandwidth (Mbps of each node's uplink or links; a comma separated list is cycled over the nodes)
+        --stakes (stake of each proof of stake node, which validators are drawn in proportion to; a comma separated
+                  list is cycled over the nodes)
+        --epoch (number of blocks in a row proposed by each proof of stake validator; 0 keeps the first validator for
+                 the whole run)
+        --stake-reward (stake a proof of stake validator earns for each epoch it proposes)
+        --seed (seed for all random number streams; identical inputs and seed give identical results)
+        --min-latency (shortest latency, in ms, of any packet between two nodes)
+        --partitions (number of worker processes the nodes are split across; needs --min-latency, which is how far
+                      the workers run ahead of each other, and gives the same results as one process)
+        --replicates (number of runs of the configuration with consecutive seeds from --seed; results.json holds
+                      their means and 95% confidence intervals)
+        --workers (number of processes to run replicates in; 1 runs them one after another in this process)
+        --checkpoint-every / --checkpoint-seconds (write a snapshot every N simulated ms / M wall-clock seconds)
+        --resume (continue from the last snapshot of this experiment)
+        --log-format (format of the per-event log: jsonl, npy or none)
+        --log-level (how much the simulator reports while running: debug, info, warning or error)
+        --profile (time each phase of the event loop and write the report to profile.json next to results.json)
 """
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from functools import partial
 import json
+import logging
 import os
-import time
+
+import numpy as np
 
 from block import Block
+from blocktable import BlockTable
+import checkpoint
+import pdes
+from eventlog import open_sink
+from gossip import Gossip
+from constants import BLOCK_SIZE, DIFFICULTY, HASH_RATE
+from keystore import make_key_provider
+from links import BandwidthModel, CongestionModel, mbps_to_bytes_per_ms
 from network import CentralizedNetwork, ProofOfStakeNetwork, ProofOfWorkNetwork
 from node import Node
+from profiler import Profiler
+import replicates
+from rng import RandomStreams
+from stake import Stakes
 from util import exponential_latency
 import utils
+from workload import open_schedule
+
+logger = logging.getLogger(__name__)
 
 
 parser = ArgumentParser(description="Bitcoin network basic simulation")
@@ -44,91 +97,383 @@ parser.add_argument('--name',
                     type=str,
                     help="Name of current experiment",
 )
-args = parser.parse_args()
+parser.add_argument('--difficulty',
+                    type=int,
+                    help="Expected number of hashes it takes to mine a block in proof of work",
+                    default=DIFFICULTY
+)
+parser.add_argument('--hash-rate',
+                    type=int,
+                    help="Number of hashes each node computes per simulated millisecond in proof of work",
+                    default=HASH_RATE
+)
+parser.add_argument('--keys',
+                    type=str,
+                    help="How node keys are created: lazy (RSA on first use), keystore (RSA persisted in --keystore), or deterministic (Ed25519 from a seed)",
+                    default="lazy"
+)
+parser.add_argument('--keystore',
+                    type=str,
+                    help="Directory that stores node keys when using --keys keystore",
+                    default="keys"
+)
+parser.add_argument('--mempool-capacity',
+                    type=int,
+                    help="Most unconfirmed transactions a node can make blocks from at once, later ones wait for room (unlimited by default)",
+                    default=None
+)
+parser.add_argument('--block-size',
+                    type=int,
+                    help="Most transactions in one block",
+                    default=BLOCK_SIZE
+)
+parser.add_argument('--block-bytes',
+                    type=int,
+                    help="Most bytes of transactions in one block (unlimited by default)",
+                    default=None
+)
+parser.add_argument('--block-wait',
+                    type=int,
+                    help="Longest a transaction waits (in ms) for a block to fill up before the block is made anyway",
+                    default=0
+)
+parser.add_argument('--checkpoint-every',
+                    type=int,
+                    help="Write a snapshot of the simulation every this many simulated ms",
+                    default=None
+)
+parser.add_argument('--checkpoint-seconds',
+                    type=float,
+                    help="Write a snapshot of the simulation every this many wall-clock seconds",
+                    default=None
+)
+parser.add_argument('--resume',
+                    action='store_true',
+                    help="Continue from the last snapshot of this experiment if there is one"
+)
+parser.add_argument('--log-format',
+                    type=str,
+                    help="Format of the per-event log written next to results.json: jsonl, npy (columnar chunks) or none",
+                    default="jsonl"
+)
+parser.add_argument('--tps',
+                    type=float,
+                    help="Average number of transactions submitted per second by a generated workload (--schedule poisson)",
+                    default=None
+)
+parser.add_argument('--txns',
+                    type=int,
+                    help="Number of transactions in a generated workload (--schedule poisson)",
+                    default=None
+)
+parser.add_argument('--senders',
+                    type=str,
+                    help="Distribution of the senders of a generated workload: uniform or zipf",
+                    default="uniform"
+)
+parser.add_argument('--zipf-exponent',
+                    type=float,
+                    help="Exponent of the zipf sender distribution of a generated workload",
+                    default=1.0
+)
+parser.add_argument('--relay',
+                    type=str,
+                    help="How broadcasts reach every node: flood (straight from the sender) or gossip (relayed by peers)",
+                    default="flood"
+)
+parser.add_argument('--degree',
+                    type=int,
+                    help="Average number of peers of each node when relaying by gossip",
+                    default=8
+)
+parser.add_argument('--seen-cache',
+                    type=int,
+                    help="Number of recent messages each node remembers to drop duplicates when relaying by gossip",
+                    default=10000
+)
+parser.add_argument('--link-model',
+                    type=str,
+                    help="How packets are held up before their latency: uplink or link (FIFO at --bandwidth) or congestion (original random delay)",
+                    default="uplink"
+)
+parser.add_argument('--bandwidth',
+                    type=str,
+                    help="Bandwidth in Mbps of each node's uplink (or of each of its links), or a comma separated list cycled over the nodes",
+                    default="20"
+)
+parser.add_argument('--stakes',
+                    type=str,
+                    help="Stake of each proof of stake node, or a comma separated list cycled over the nodes",
+                    default="1"
+)
+parser.add_argument('--epoch',
+                    type=int,
+                    help="Number of blocks in a row proposed by each proof of stake validator (0 never rotates the validator)",
+                    default=0
+)
+parser.add_argument('--stake-reward',
+                    type=float,
+                    help="Stake a proof of stake validator earns for each epoch it proposes",
+                    default=0
+)
+parser.add_argument('--log-level',
+                    type=str,
+                    help="Lowest level of messages reported while running: debug, info, warning or error",
+                    default="info"
+)
+parser.add_argument('--profile',
+                    action='store_true',
+                    help="Time each phase of the event loop and write a report to profile.json next to results.json"
+)
+parser.add_argument('--seed',
+                    type=int,
+                    help="Seed for every random number stream, so identical inputs give identical results (random by default)",
+                    default=None
+)
+parser.add_argument('--min-latency',
+                    type=int,
+                    help="Shortest latency (in ms) of a packet between two nodes; latencies drawn below it are raised to it",
+                    default=0
+)
+parser.add_argument('--partitions',
+                    type=int,
+                    help="Number of worker processes to split the nodes across, exchanging packets every --min-latency ms",
+                    default=1
+)
+parser.add_argument('--replicates',
+                    type=int,
+                    help="Number of runs of the configuration with consecutive seeds, merged into means and confidence intervals",
+                    default=1
+)
+parser.add_argument('--workers',
+                    type=int,
+                    help="Number of processes to run replicates in (defaults to the number of cores)",
+                    default=os.cpu_count()
+)
 
 
-def init_nodes(net, n=3): 
+def init_nodes(net, n=3, difficulty=DIFFICULTY, hash_rate=HASH_RATE, keys=None, mempool_capacity=None, rngs=None, block_size=BLOCK_SIZE, block_bytes=None, block_wait=0): 
     """
-    Initialize the passed in number of nodes for our network
+    Initialize the passed in number of nodes for our network, sharing one key provider and one block table between them.
+    rngs has one random generator per node for its block nonces
     """
-    genesis_block = Block(block_id=0, data="genesis block", timestamp=time.time())
+    genesis_block = Block(block_id=0, data=("genesis block",), timestamp=0)
+    table = BlockTable()
+    if keys is None:
+        keys = make_key_provider("lazy")
     nodes = []
     for i in range(n):
-        nodes.append(Node(i, net, genesis_block))
+        nodes.append(Node(i, net, genesis_block, difficulty=difficulty, hash_rate=hash_rate, keys=keys, mempool_capacity=mempool_capacity, rng=rngs[i] if rngs is not None else None, block_size=block_size, block_bytes=block_bytes, block_wait=block_wait, table=table))
     return nodes
 
-def clean_up_json(data):
-    """
-    Takes a json with all values typed string, and re-assigns them to be of the correct type
-    (integer keys, with lists of [int, str])
-    """
-    clean_data = {}
-    for k, v in data.items():
-        new_v = []
-        for timestamp, txn_data in v:
-            new_v.append((int(timestamp), txn_data))
-        clean_data[int(k)] = new_v
-    return clean_data
-
-
 def create_topology(key, num_nodes):
     """
-    Based off of the passed in key and the number of nodes, returns a dictionary that
-    keeps track of the mean latency between a set of nodes
+    Based off of the passed in key and the number of nodes, returns a matrix that
+    keeps track of the mean latency between every pair of nodes
     """
-    topo = {}
     if key == "equadistant":
-        for n1 in range(num_nodes):
-            for n2 in range(n1+1, num_nodes):
-                topo[(n1, n2)] = 200
+        topo = np.full((num_nodes, num_nodes), 200, dtype=np.int32)
     elif key == "wide-area":
         q1 = num_nodes//4
         q2 = 2*q1
         q3 = 3*q1
-        for n1 in range(num_nodes):
-            for n2 in range(num_nodes):
-                if (n1 <= q1 and n2 <= q1) or (q1 < n1 <= q2 and q1 < n2 <= q2) or (q2 < n1 <= q3 and q2 < n2 <= q3) or (q3 < n1 <= num_nodes and q3 < n2 <= num_nodes):
-                    topo[(n1, n2)] = 200
-                else:
-                    topo[(n1, n2)] = 400
+        # nodes in the same quarter are close together, nodes in different quarters are far apart
+        region = np.searchsorted([q1, q2, q3], np.arange(num_nodes))
+        topo = np.where(region[:, None] == region[None, :], 200, 400).astype(np.int32)
     else:
         raise Exception(f"Invalid key: {key} does not exist!  Try using 'equadistant' or 'wide-area'")
 
     return topo
         
 
-if __name__ == "__main__":
-    if not args.name:
-        raise Exception("Need to enter a valid name using the --name flag")
+def create_link_model(key, bandwidth, streams):
+    """
+    Based off of the passed in key, returns the model of how long each packet waits before its latency starts
+    """
+    if key == "congestion":
+        return CongestionModel(streams.congestion)
+    if key not in ("uplink", "link"):
+        raise Exception(f"Invalid link model: {key} does not exist!  Try using 'uplink', 'link' or 'congestion'")
+    mbps = [float(b) for b in bandwidth.split(",")]
+    return BandwidthModel(mbps_to_bytes_per_ms(mbps), per_link=key == "link")
+
+
+def create_stakes(stakes, num_nodes, reward, streams):
+    """
+    Stakes of every node, from a comma separated list cycled over the nodes, and the draws of the validators
+    """
+    values = [float(s) for s in stakes.split(",")]
+    return Stakes(np.resize(values, num_nodes), streams.validator, reward)
 
-    # grabbing the pre-determined schedule
-    with open(os.path.join("schedules", f"{args.schedule}.json")) as f:
-        schedule = json.load(f)
-        clean_schedule = clean_up_json(schedule)
 
+def results_dir(args):
+    """
+    Directory that the results of the experiment described by args are stored in
+    """
+    return f"results/{args.name}-{args.type}-{args.topo}-{args.nodes}-nodes"
+
+
+def create_network(args):
+    """
+    Builds the network and its nodes for the experiment described by args, starting at time 0
+    """
     topo = create_topology(args.topo, args.nodes)
+    streams = RandomStreams(args.seed)
+    # the schedule is read (or generated) lazily as the simulation reaches it
+    schedule = open_schedule(args.schedule, args.nodes, streams.workload, args.tps, args.txns, args.senders, args.zipf_exponent)
+    if args.relay == "gossip":
+        gossip = Gossip(args.degree, args.seen_cache, streams.topology)
+    elif args.relay == "flood":
+        gossip = None
+    else:
+        raise Exception(f"Invalid relay: {args.relay} does not exist!  Try using 'flood' or 'gossip'")
+
+    links = create_link_model(args.link_model, args.bandwidth, streams)
+    # every node draws from its own streams, so a node's draws don't depend on how the nodes are partitioned
+    latency_fn = exponential_latency(topo, streams.per_node("latency", args.nodes), args.min_latency, partial(streams.node_stream, "latency"))
 
     # initialize the right network given the passed in type
     if args.type == "pow":
-        net = ProofOfWorkNetwork([], exponential_latency(topo), clean_schedule)
+        net = ProofOfWorkNetwork([], latency_fn, schedule, streams, gossip, links)
     elif args.type == "c":
-        net = CentralizedNetwork([], exponential_latency(topo), clean_schedule)
+        net = CentralizedNetwork([], latency_fn, schedule, streams, gossip, links)
     elif args.type == "pos":
-        net = ProofOfStakeNetwork([], exponential_latency(topo), clean_schedule)
+        if args.epoch < 0:
+            raise Exception(f"Epochs can't have a negative number of blocks, got {args.epoch}")
+        stakes = create_stakes(args.stakes, args.nodes, args.stake_reward, streams)
+        net = ProofOfStakeNetwork([], latency_fn, schedule, streams, gossip, links, stakes, args.epoch)
     else:
         raise Exception(f"{args.type} is not a valid type")
-    nodes = init_nodes(net, args.nodes)
+    keys = make_key_provider(args.keys, args.keystore, args.seed if args.seed is not None else 0)
+    nodes = init_nodes(net, args.nodes, args.difficulty, args.hash_rate, keys, args.mempool_capacity, streams.per_node("nonce", args.nodes), args.block_size, args.block_bytes, args.block_wait)
     net.assign_nodes(nodes)
+    return net
+
+
+def create_partitioned_network(args):
+    """
+    Builds a network that runs the experiment described by args across --partitions worker processes
+    """
+    if args.min_latency < 1:
+        raise Exception("--partitions needs a --min-latency of at least 1 ms, which is how far ahead the partitions can run")
+    if args.link_model == "congestion":
+        raise Exception("--link-model congestion can't be partitioned: its delays depend on when other nodes receive packets")
+    if args.checkpoint_every is not None or args.checkpoint_seconds is not None or args.resume or args.profile:
+        raise Exception("Partitioned runs don't support checkpoints or profiling")
+    if args.seed is None:
+        # every worker has to draw the same random numbers
+        args = copy.copy(args)
+        args.seed = RandomStreams().entropy
+    return pdes.partitioned_network(create_network, args, args.partitions, args.min_latency)
+
+
+def simulate(args):
+    """
+    Runs the experiment described by the parsed command line arguments and writes its results.json
+    """
+    if not args.name:
+        raise Exception("Need to enter a valid name using the --name flag")
+    if args.replicates > 1:
+        return simulate_replicates(args)
+
+    utils.mkdir_if_not_exists(results_dir(args))
+    snapshot_path = f"{results_dir(args)}/checkpoint.pkl.gz"
+    if args.resume and os.path.exists(snapshot_path):
+        net = checkpoint.load(snapshot_path)
+        logger.info(f"Resuming from the snapshot at time {net.time}")
+    elif args.partitions > 1:
+        net = create_partitioned_network(args)
+    else:
+        net = create_network(args)
+    net.log = open_sink(args.log_format, results_dir(args), net.log_position)
+    if args.checkpoint_every is not None or args.checkpoint_seconds is not None:
+        net.checkpointer = checkpoint.Checkpointer(snapshot_path, args.checkpoint_every, args.checkpoint_seconds)
+
+    if args.profile:
+        net.profiler = Profiler()
+
+    # processes events in the network until all transactions have been verfied across all nodes
+    summary = net.run()
+    net.log.close()
+    logger.info("All transactions have been verified")
+    if args.profile:
+        report = net.profiler.report(net)
+        with open(f"{results_dir(args)}/profile.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Simulated {report['simulated_ms']} ms in {report['wall_seconds']:.2f}s ({report['simulated_ms_per_wall_second']:.0f} ms per second)")
+        for name, phase in report["phases"].items():
+            logger.debug(f"{name}: {phase['seconds']:.3f}s over {phase['calls']} calls")
+    results = {"metrics": {**summary, **net.incoming_messages.stats(), **net.mempool_stats(), **net.links.stats()}}
+
+    with open(f"{results_dir(args)}/results.json", 'w') as f:
+        json.dump(results, f)
+    # the run finished, so there is nothing left to resume
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    return results
+
+
+def replicate_args(args):
+    """
+    Arguments of every replicate of the experiment: the same configuration with consecutive seeds, each with its own
+    results directory
+    """
+    first = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % (1 << 31))
+    runs = []
+    for seed in range(first, first + args.replicates):
+        run = copy.copy(args)
+        run.seed = seed
+        run.name = f"{args.name}-seed-{seed}"
+        run.replicates = 1
+        runs.append(run)
+    return runs
+
 
-    # continues to increment time in the network until all transactions have been verfied across all nodes
-    while True:
-        res = net.tick()
-        if res is not None:
-            print("All transactions have been verified")
-            latencies, consensus, computations, packets = res
-            latencies["metrics"] = {"num_computations": computations, "num_packets": packets}
-
-            utils.mkdir_if_not_exists(f"results/{args.name}-{args.type}-{args.topo}-{args.nodes}-nodes")
-            with open(f"results/{args.name}-{args.type}-{args.topo}-{args.nodes}-nodes/results.json", 'w') as f:
-                json.dump(latencies, f)
-            break
\ No newline at end of file
+def run_replicate(args):
+    """
+    Runs one replicate and returns its metrics
+    """
+    # the progress of a single replicate would drown out the progress of the whole experiment
+    logging.disable(logging.INFO)
+    try:
+        return simulate(args)["metrics"]
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def simulate_replicates(args):
+    """
+    Runs every replicate of the experiment, in a pool of processes that each run several of them, and writes the
+    merged metrics and their confidence intervals to the experiment's results.json
+    """
+    runs = replicate_args(args)
+    workers = max(1, min(args.workers, len(runs)))
+    if workers == 1:
+        metrics = [run_replicate(run) for run in runs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            metrics = list(pool.map(run_replicate, runs))
+    merged, intervals = replicates.merge(metrics)
+    results = {"metrics": merged, "intervals": intervals, "seeds": [run.seed for run in runs]}
+    utils.mkdir_if_not_exists(results_dir(args))
+    with open(f"{results_dir(args)}/results.json", 'w') as f:
+        json.dump(results, f)
+    latency = intervals["average_latency"]
+    logger.info(f"Average Latency over {len(runs)} replicates: {latency['mean']} (95% CI {latency['ci_low']:.2f} to {latency['ci_high']:.2f})")
+    return results
+
+
+def configure_logging(level):
+    """
+    Reports messages of the given level name and above on stderr
+    """
+    numeric = logging.getLevelName(level.upper())
+    if not isinstance(numeric, int):
+        raise Exception(f"Invalid log level: {level} does not exist!  Try using 'debug', 'info', 'warning' or 'error'")
+    logging.basicConfig(level=numeric, format="%(message)s")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    simulate(args)
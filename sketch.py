@@ -0,0 +1,100 @@
+"""
+Streaming quantile sketch (in the style of DDSketch) for latency metrics.  Values are counted in logarithmically
+sized buckets, so any quantile is known to within a fixed relative error, and two sketches merge exactly by adding
+their bucket counts
+"""
+import math
+
+
+class QuantileSketch:
+    """
+    Mergeable sketch of non-negative values.  Quantiles are accurate to within relative_accuracy of the true value
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {} # maps from bucket index to the number of values in (gamma^(index-1), gamma^index]
+        self.zero_count = 0 # number of values that are 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        Adds one value to the sketch
+        """
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """
+        Adds every value counted by another sketch with the same accuracy to this one
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception(f"Can't merge sketches with accuracies {self.relative_accuracy} and {other.relative_accuracy}")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        """
+        Estimates the value at the given quantile (between 0 and 1), or None if the sketch is empty
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                # middle of the bucket in relative terms
+                estimate = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentiles(self):
+        """
+        Summary of the distribution: the mean and the 50th, 95th and 99th percentiles
+        """
+        return {"mean": self.mean(), "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(key): count for key, count in sorted(self.bins.items())},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.bins = {int(key): count for key, count in data["bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.total = data["total"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
@@ -0,0 +1,75 @@
+"""
+Stake of every proof of stake node and the validator that proposes each epoch's blocks, drawn with probability
+proportional to stake.  Draws go through an alias table, which takes O(n) to build but O(1) per draw, and is only
+rebuilt when the stakes change
+"""
+import numpy as np
+
+
+class AliasTable:
+    """
+    Walker's alias method (Vose's construction): every index gets a bucket holding its own share and the index of
+    one other heavier index that fills the rest, so a draw is one bucket and one coin flip
+    """
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        if n == 0 or (weights < 0).any() or weights.sum() <= 0:
+            raise Exception(f"Stakes must be non-negative and not all zero, got {weights}")
+        scaled = weights * n / weights.sum()
+        prob = np.ones(n, dtype=np.float64)
+        alias = np.arange(n, dtype=np.int64)
+        small = np.flatnonzero(scaled < 1).tolist()
+        large = np.flatnonzero(scaled >= 1).tolist()
+        scaled = scaled.tolist()
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        # whatever is left over is full up to rounding error
+        self.n = n
+        self.prob = prob.tolist()
+        self.alias = alias.tolist()
+
+    def draw(self, rng):
+        """
+        Index drawn with probability proportional to its weight, from a single uniform number
+        """
+        u = rng.random() * self.n
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+
+class Stakes:
+    """
+    Every node's stake, and the proposer of every epoch.  Proposers are drawn in epoch order and remembered, so
+    every process that simulates some of the nodes draws the same proposers no matter which nodes ask first
+    """
+    def __init__(self, stakes, rng, reward=0):
+        self.stakes = np.asarray(stakes, dtype=np.float64).copy()
+        self.rng = rng # draws the proposers
+        self.reward = reward # stake a proposer earns at the end of each of its epochs
+        self.table = None # alias table of the current stakes, rebuilt on the next draw after they change
+        self.proposers = [] # node id of the proposer of each epoch drawn so far
+
+    def set_stake(self, node_id, stake):
+        self.stakes[node_id] = stake
+        self.table = None
+
+    def proposer(self, epoch):
+        """
+        Node id of the given epoch's proposer
+        """
+        while len(self.proposers) <= epoch:
+            if self.proposers and self.reward:
+                last = self.proposers[-1]
+                self.set_stake(last, self.stakes[last] + self.reward)
+            if self.table is None:
+                self.table = AliasTable(self.stakes)
+            self.proposers.append(self.table.draw(self.rng))
+        return self.proposers[epoch]
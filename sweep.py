@@ -0,0 +1,185 @@
+"""
+Runs every configuration of an experiment spec across a pool of processes, skipping configurations whose results
+are already up to date.
+
+Usage:
+    ARGS:
+        --spec (json file listing experiments; each one has a name and lists of types, topos, nodes, schedules and
+                optionally seeds, and every combination of them is run)
+        --workers (number of processes to run configurations in, defaults to the number of cores)
+        --force (re-run configurations even if their results are up to date)
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+import replicates
+import simulator
+import utils
+import workload
+
+
+logger = logging.getLogger(__name__)
+
+parser = ArgumentParser(description="Runs a sweep of simulations in parallel")
+parser.add_argument('--spec',
+                    type=str,
+                    help="Json file describing the experiments to run",
+                    default="experiments/published.json"
+)
+parser.add_argument('--workers',
+                    type=int,
+                    help="Number of processes to run configurations in",
+                    default=os.cpu_count()
+)
+parser.add_argument('--force',
+                    action='store_true',
+                    help="Re-run configurations even if their results are up to date"
+)
+
+
+def expand(spec):
+    """
+    Expands every experiment in the spec into the simulator arguments for each combination of
+    (type, topo, nodes, schedule, seed).  Returns a list of (group, args), where runs that only differ by
+    their seed share a group
+    """
+    configs = []
+    for experiment in spec:
+        seeds = experiment.get("seeds", [None])
+        grid = itertools.product(experiment["types"], experiment["topos"], experiment["nodes"], experiment["schedules"], seeds)
+        for protocol, topo, nodes, schedule, seed in grid:
+            argv = ["--type", protocol, "--topo", topo, "--nodes", str(nodes), "--schedule", schedule]
+            # replicates of a configuration get their own results directory
+            name = experiment["name"] if len(seeds) == 1 else f"{experiment['name']}-seed-{seed}"
+            argv += ["--name", name]
+            if seed is not None:
+                argv += ["--seed", str(seed)]
+            for flag, value in experiment.get("args", {}).items():
+                argv += [f"--{flag}", str(value)]
+            group = f"{experiment['name']}-{protocol}-{topo}-{nodes}-nodes-{schedule}"
+            configs.append((group, simulator.parser.parse_args(argv)))
+    return configs
+
+
+def fingerprint(args):
+    """
+    Summarizes everything that determines the results of a configuration: its arguments and the contents of its
+    schedule
+    """
+    # generated workloads are fully determined by the arguments
+    if args.schedule == workload.GENERATED:
+        return {"args": vars(args), "schedule": None}
+    schedule_hash = hashlib.sha256()
+    with open(workload.schedule_path(args.schedule), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            schedule_hash.update(chunk)
+    return {"args": vars(args), "schedule": schedule_hash.hexdigest()}
+
+
+def cached_run(args):
+    """
+    Returns the recorded run of the configuration if its results were produced from the same inputs, otherwise None
+    """
+    results_dir = simulator.results_dir(args)
+    if not os.path.exists(f"{results_dir}/results.json") or not os.path.exists(f"{results_dir}/run.json"):
+        return None
+    with open(f"{results_dir}/run.json") as f:
+        run = json.load(f)
+    if run["inputs"] != fingerprint(args):
+        return None
+    return run
+
+
+def run_config(args):
+    """
+    Runs one configuration in a worker process, and records its inputs and wall time next to its results
+    """
+    start = time.time()
+    # the progress of a single run would drown out the progress of the sweep
+    logging.disable(logging.INFO)
+    try:
+        simulator.simulate(args)
+    finally:
+        logging.disable(logging.NOTSET)
+    wall_time = time.time() - start
+    with open(f"{simulator.results_dir(args)}/run.json", 'w') as f:
+        json.dump({"inputs": fingerprint(args), "wall_time": wall_time}, f)
+    return wall_time
+
+
+def aggregate(configs):
+    """
+    Merges the runs of each group, giving percentiles across all of the group's seeds and the mean and confidence
+    interval of every metric
+    """
+    groups = {}
+    for group, args in configs:
+        with open(f"{simulator.results_dir(args)}/results.json") as f:
+            groups.setdefault(group, []).append(json.load(f)["metrics"])
+    merged = {}
+    for group, runs in groups.items():
+        metrics, intervals = replicates.merge(runs)
+        merged[group] = {"runs": len(runs), "latency_percentiles": metrics["latency_percentiles"], "consensus_percentiles": metrics["consensus_percentiles"], "intervals": intervals}
+    return merged
+
+
+def sweep(configs, workers, force=False):
+    """
+    Runs every configuration that isn't up to date, largest networks first.  Returns the wall time of each run,
+    the recorded wall time of each configuration that was skipped, and the error of each run that failed.  A
+    failed run doesn't stop the others
+    """
+    pending = []
+    cached = {}
+    for args in configs:
+        run = None if force else cached_run(args)
+        if run is None:
+            pending.append(args)
+        else:
+            cached[simulator.results_dir(args)] = run["wall_time"]
+    pending.sort(key=lambda args: args.nodes, reverse=True)
+    logger.info(f"{len(cached)} of {len(configs)} configurations are up to date, running {len(pending)}")
+
+    wall_times = {}
+    failed = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_config, args): simulator.results_dir(args) for args in pending}
+        for future in as_completed(futures):
+            try:
+                wall_times[futures[future]] = future.result()
+            except Exception as e:
+                failed[futures[future]] = repr(e)
+                logger.error(f"{futures[future]}: failed with {e!r}")
+                continue
+            logger.info(f"{futures[future]}: {wall_times[futures[future]]:.2f}s")
+    return wall_times, cached, failed
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    simulator.configure_logging("info")
+    with open(args.spec) as f:
+        spec = json.load(f)
+
+    start = time.time()
+    configs = expand(spec)
+    wall_times, cached, failed = sweep([config for _, config in configs], args.workers, args.force)
+    total = time.time() - start
+
+    finished = [(group, config) for group, config in configs if simulator.results_dir(config) not in failed]
+    summary = {"runs": wall_times, "cached": cached, "failed": failed, "total_run_time": sum(wall_times.values()), "elapsed": total, "workers": args.workers, "groups": aggregate(finished)}
+    utils.mkdir_if_not_exists("results")
+    spec_name = os.path.splitext(os.path.basename(args.spec))[0]
+    with open(f"results/sweep-{spec_name}.json", 'w') as f:
+        json.dump(summary, f)
+    logger.info(f"Ran {len(wall_times)} configurations in {total:.2f}s ({summary['total_run_time']:.2f}s of simulation)")
+    if failed:
+        logger.error(f"{len(failed)} configurations failed: {', '.join(sorted(failed))}")
+        sys.exit(1)
@@ -0,0 +1,193 @@
+"""
+Checks of the guarantees the simulator makes that are easy to break without noticing: partitioned runs give the same
+results and event log as a single process, mempools don't hold on to confirmed transactions, validators are drawn in
+proportion to stake, and replicate metrics merge into the right means, intervals and percentiles.  Run with
+`python3 -m pytest test_simulator.py`
+"""
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+
+from mempool import COMPACT_SLACK, Mempool
+from block import Block
+from blockchain import Blockchain
+from blocktable import BlockTable
+import replicates
+import simulator
+import sweep
+import workload
+from sketch import QuantileSketch
+from stake import AliasTable, Stakes
+
+
+def run(name, *extra):
+    """
+    Runs a small seeded experiment into results/ under the current directory, and returns the bytes of its
+    results.json and event log
+    """
+    args = simulator.parser.parse_args([
+        "--name", name, "--nodes", "6", "--topo", "wide-area", "--schedule", "poisson", "--tps", "40",
+        "--txns", "60", "--seed", "7", "--min-latency", "50", "--log-level", "warning", *extra,
+    ])
+    simulator.simulate(args)
+    directory = simulator.results_dir(args)
+    with open(f"{directory}/results.json", "rb") as f, open(f"{directory}/events.jsonl", "rb") as g:
+        return f.read(), g.read()
+
+
+def test_mempool_queue_stays_bounded():
+    pool = Mempool()
+    rng = np.random.default_rng(2)
+    for i in range(5000):
+        pool.add(f"txn {i}", i)
+        if i % 3 == 2:
+            txns, _ = pool.batch(2)
+            for txn in txns:
+                pool.remove(txn)
+            # other nodes' blocks confirm transactions from anywhere in the queue
+            pool.remove(f"txn {rng.integers(i + 1)}")
+        assert len(pool.queue) <= 2 * len(pool) + COMPACT_SLACK
+
+
+def test_mempools_are_empty_after_a_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = simulator.parser.parse_args(["--name", "mempool", "--type", "pow", "--nodes", "6", "--topo", "equadistant",
+                                        "--schedule", "poisson", "--tps", "50", "--txns", "200", "--seed", "1",
+                                        "--difficulty", "200", "--log-format", "none"])
+    net = simulator.create_network(args)
+    net.run()
+    for node in net.nodes:
+        assert len(node.ledger.unconfirmed_txns) == 0
+        assert len(node.ledger.unconfirmed_txns.queue) <= COMPACT_SLACK
+
+
+def test_reorg_puts_transactions_back_in_arrival_order():
+    table = BlockTable()
+    genesis = Block(block_id=0, data=[], timestamp=0)
+    ours = Blockchain(genesis, table=table, block_size=2)
+    theirs = Blockchain(genesis, table=table, block_size=2)
+    for time, txn in [(10, "t1"), (20, "t2"), (30, "t3"), (40, "t4")]:
+        ours.add_incoming_txn(txn, time)
+    ours.mine_pos(50)
+    ours.mine_pos(60)
+    # a longer branch without our blocks makes us put their transactions back, the newest block's first
+    for time, txn in [(70, "x"), (80, "y"), (90, "z")]:
+        theirs.add_incoming_txn(txn, time)
+        block, _ = theirs.mine_pos(time)
+        ours.add_block(block)
+    assert ours.reorgs == 1
+    assert ours.unconfirmed_txns.batch(4) == (["t1", "t2", "t3", "t4"], True)
+    assert ours.unconfirmed_txns.arrival("t1") == 10
+
+
+@pytest.mark.parametrize("protocol", [
+    ["--type", "c"],
+    ["--type", "pos"],
+    ["--type", "pos", "--epoch", "1", "--stakes", "1,3"],
+    ["--type", "pow", "--difficulty", "200"],
+    ["--type", "pow", "--difficulty", "200", "--relay", "gossip", "--degree", "4"],
+])
+@pytest.mark.parametrize("partitions", [2, 3])
+def test_partitioned_run_matches_serial(tmp_path, monkeypatch, protocol, partitions):
+    monkeypatch.chdir(tmp_path)
+    assert run("partitioned", "--partitions", str(partitions), *protocol) == run("serial", *protocol)
+
+
+@pytest.mark.parametrize("protocol", [["--type", "c"], ["--type", "pos"], ["--type", "pow", "--difficulty", "200"]])
+def test_senders_outside_the_network(tmp_path, monkeypatch, protocol):
+    # basic_schedule has five senders, so at three nodes two of them are clients outside the network
+    monkeypatch.setattr(workload, "SCHEDULE_DIR", os.path.abspath(workload.SCHEDULE_DIR))
+    monkeypatch.chdir(tmp_path)
+    extra = ["--nodes", "3", "--topo", "equadistant", "--schedule", "basic_schedule", *protocol]
+    serial = run("serial", *extra)
+    assert run("partitioned", "--partitions", "2", *extra) == serial
+    assert b'"num_transactions": 31' in serial[0]
+
+
+def test_published_sweep_runs_smallest_networks(tmp_path, monkeypatch):
+    with open("experiments/published.json") as f:
+        spec = json.load(f)
+    monkeypatch.setattr(workload, "SCHEDULE_DIR", os.path.abspath(workload.SCHEDULE_DIR))
+    monkeypatch.chdir(tmp_path)
+    configs = [args for _, args in sweep.expand(spec) if args.nodes <= 5]
+    wall_times, cached, failed = sweep.sweep(configs, workers=2)
+    assert failed == {}
+    assert len(wall_times) == len(configs) and not cached
+
+
+def test_alias_table_draws_in_proportion_to_weight():
+    weights = np.array([1, 2, 3, 4, 0, 10], dtype=np.float64)
+    table = AliasTable(weights)
+    rng = np.random.default_rng(1)
+    draws = 200000
+    counts = np.bincount([table.draw(rng) for _ in range(draws)], minlength=len(weights))
+    expected = weights / weights.sum() * draws
+    assert counts[4] == 0
+    # far outside of the binomial standard deviation of every count
+    assert (np.abs(counts - expected) <= 5 * np.sqrt(expected + 1)).all()
+
+
+def test_alias_table_rejects_bad_weights():
+    for weights in ([], [0, 0], [1, -1]):
+        with pytest.raises(Exception):
+            AliasTable(weights)
+
+
+def test_proposers_do_not_depend_on_query_order():
+    forward = Stakes([1, 2, 5, 1], np.random.default_rng(3), reward=2)
+    backward = Stakes([1, 2, 5, 1], np.random.default_rng(3), reward=2)
+    assert [forward.proposer(e) for e in range(50)] == [backward.proposer(e) for e in reversed(range(50))][::-1]
+
+
+def test_interval_of_known_values():
+    stats = replicates.interval([1, 2, 3, 4, 5])
+    std = math.sqrt(2.5)
+    half = 2.776 * std / math.sqrt(5)
+    assert stats["n"] == 5
+    assert stats["mean"] == 3
+    assert stats["std"] == pytest.approx(std)
+    assert stats["ci_low"] == pytest.approx(3 - half)
+    assert stats["ci_high"] == pytest.approx(3 + half)
+    assert replicates.interval([4]) == {"n": 1, "mean": 4, "std": 0.0, "ci_low": 4, "ci_high": 4}
+
+
+def test_t_critical_uses_table_and_large_samples():
+    assert replicates.t_critical(1) == 12.706
+    assert replicates.t_critical(30) == 2.042
+    assert replicates.t_critical(50) == 2.021
+    assert replicates.t_critical(5000) == 1.962
+
+
+def test_sketch_merge_is_exact():
+    rng = np.random.default_rng(5)
+    values = rng.exponential(300, 5000).round().tolist()
+    whole = QuantileSketch()
+    halves = [QuantileSketch(), QuantileSketch()]
+    for i, value in enumerate(values):
+        whole.add(value)
+        halves[i % 2].add(value)
+    halves[0].merge(halves[1])
+    assert halves[0].to_dict() == whole.to_dict()
+    assert halves[0].percentiles() == whole.percentiles()
+
+
+def test_merge_replicates():
+    runs = []
+    for offset in (0, 10, 20):
+        sketch = QuantileSketch()
+        for value in range(offset, offset + 10):
+            sketch.add(value)
+        runs.append({"num_blocks": offset, "chain": {"depth": offset / 10}, "name": "run",
+                     "latency_sketch": sketch.to_dict(), "latency_percentiles": sketch.percentiles()})
+    metrics, intervals = replicates.merge(runs)
+    assert metrics["num_blocks"] == 10
+    assert metrics["chain"] == {"depth": 1}
+    assert intervals["num_blocks"]["std"] == pytest.approx(10)
+    assert metrics["name"] is None
+    combined = QuantileSketch()
+    for value in range(30):
+        combined.add(value)
+    assert metrics["latency_percentiles"] == combined.percentiles()
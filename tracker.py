@@ -0,0 +1,59 @@
+"""
+Keeps track of how many nodes have each transaction in their chain, so the network can tell which transactions are
+agreed upon by a majority of nodes and by all nodes without walking every chain from the genesis block
+"""
+from blocktable import Bitset
+
+
+class ConfirmationTracker:
+    """
+    Incrementally maintained confirmation counts.  Ledgers report the transactions of every block they append to
+    or drop from their chain, and the tracker reports each transaction the first time it is in the chains of a
+    majority of nodes and of all of the nodes
+    """
+    def __init__(self, num_nodes):
+        self.majority = round(num_nodes/2)
+        self.num_nodes = num_nodes
+        self.confirmations = [] # maps from transaction id to the number of nodes that have it in their chain
+        self.majority_reached = Bitset() # transactions that have been in the chains of a majority of nodes
+        self.consensus_reached = Bitset() # transactions that have been in the chains of all nodes
+        self.new_majority = [] # transactions that reached a majority of nodes since they were last taken
+        self.new_consensus = [] # transactions that reached all nodes since they were last taken
+
+    def confirm(self, txn_ids):
+        """
+        Records that one more node has the given transactions in its chain
+        """
+        for i in txn_ids:
+            if i >= len(self.confirmations):
+                self.confirmations.extend([0] * (i + 1 - len(self.confirmations)))
+            self.confirmations[i] += 1
+            count = self.confirmations[i]
+            if count >= self.majority and i not in self.majority_reached:
+                self.majority_reached.add(i)
+                self.new_majority.append(i)
+            if count == self.num_nodes and i not in self.consensus_reached:
+                self.consensus_reached.add(i)
+                self.new_consensus.append(i)
+
+    def unconfirm(self, txn_ids):
+        """
+        Records that a node dropped the given transactions from its chain when it switched branches.  A transaction
+        is only reported the first time it reaches a majority or all nodes
+        """
+        for i in txn_ids:
+            self.confirmations[i] -= 1
+
+    def take_majority(self):
+        """
+        Returns the transactions that reached a majority of nodes since the last call
+        """
+        txn_ids, self.new_majority = self.new_majority, []
+        return txn_ids
+
+    def take_consensus(self):
+        """
+        Returns the transactions that reached all nodes since the last call
+        """
+        txn_ids, self.new_consensus = self.new_consensus, []
+        return txn_ids
@@ -29,16 +29,84 @@ def generate_keys():
 
     return public_key, private_key
 
-def exponential_latency(mapping):
-    """
-    Generates a function to calculate latencies from a Poisson distribution between two nodes
-    """
-    def calcuate_latency(start, end):
-        if (start, end) not in mapping and (end, start) not in mapping:
-            return np.random.poisson(500)
-        
-        if (start, end) in mapping:
-            return np.random.poisson(mapping[(start, end)])
-        if (end, start) in mapping:
-            return np.random.poisson(mapping[(end, start)])
-    return calcuate_latency
\ No newline at end of file
+DEFAULT_LATENCY = 500 # mean latency between nodes that aren't part of the topology
+SAMPLE_BUDGET = 1 << 18 # total number of pre-sampled latencies kept across all pools
+
+
+def latency_matrix(mapping, num_nodes=None):
+    """
+    Converts a dictionary mapping (node, node) pairs to mean latencies into a dense matrix.  Pairs are symmetric
+    and any pair missing from the mapping gets the default latency
+    """
+    if num_nodes is None:
+        num_nodes = 1 + max((max(pair) for pair in mapping), default=-1)
+    means = np.full((num_nodes, num_nodes), DEFAULT_LATENCY, dtype=np.int32)
+    for (start, end), mean in mapping.items():
+        means[end, start] = mean
+    for (start, end), mean in mapping.items():
+        means[start, end] = mean
+    return means
+
+
+class PoissonLatency:
+    """
+    Draws latencies from a Poisson distribution around the mean latency between two nodes, never below the
+    minimum latency.  Every sending node draws from its own generator, so its latencies don't depend on what the
+    other nodes sent.  Samples are drawn in bulk into one pool per sender and distinct mean latency, so each packet
+    only costs an array lookup.  Senders outside the topology (clients named by a schedule that has more senders
+    than there are nodes) have the default latency to every node
+    """
+    def __init__(self, means, rngs=None, buffer_size=4096, min_latency=0, spawn=None):
+        self.means = means
+        if rngs is None:
+            rngs = [np.random.default_rng() for _ in range(max(len(means), 1))]
+        self.rngs = rngs # one generator per sending node
+        self.spawn = spawn # makes the generator of a sender outside the topology from its id, if given
+        self.outside = {} # generators of the senders outside the topology, by id
+        self.min_latency = min_latency
+        values, codes = np.unique(means, return_inverse=True)
+        self.values = values # distinct mean latencies in the topology
+        self.codes = codes.reshape(means.shape).astype(np.min_scalar_type(len(values))) # index of the pool of every pair
+        self.buffer_size = max(16, min(buffer_size, SAMPLE_BUDGET // max(len(values) * len(means), 1)))
+        self.pools = [[None] * len(values) for _ in range(len(means))]
+        self.cursors = [[self.buffer_size] * len(values) for _ in range(len(means))]
+
+    def outside_rng(self, start):
+        """
+        Generator of a sender outside the topology
+        """
+        if self.spawn is None:
+            return self.rngs[start % len(self.rngs)]
+        if start not in self.outside:
+            self.outside[start] = self.spawn(start)
+        return self.outside[start]
+
+    def __call__(self, start, end):
+        if start >= len(self.means) or end >= len(self.means):
+            return max(int(self.outside_rng(start).poisson(DEFAULT_LATENCY)), self.min_latency)
+        k = self.codes[start, end]
+        cursors = self.cursors[start]
+        i = cursors[k]
+        if i == self.buffer_size:
+            self.pools[start][k] = np.maximum(self.rngs[start].poisson(self.values[k], size=self.buffer_size), self.min_latency).tolist()
+            i = 0
+        cursors[k] = i + 1
+        return self.pools[start][k][i]
+
+    def row(self, start, ends):
+        """
+        Draws the latencies from one node to each of the given nodes in a single call
+        """
+        if start >= len(self.means):
+            return np.maximum(self.outside_rng(start).poisson(DEFAULT_LATENCY, size=len(ends)), self.min_latency)
+        return np.maximum(self.rngs[start].poisson(self.means[start, ends]), self.min_latency)
+
+
+def exponential_latency(mapping, rngs=None, min_latency=0, spawn=None):
+    """
+    Generates a function to calculate latencies from a Poisson distribution between two nodes.  The topology can
+    either be a matrix of mean latencies or a dictionary mapping (node, node) pairs to mean latencies
+    """
+    if isinstance(mapping, dict):
+        mapping = latency_matrix(mapping)
+    return PoissonLatency(np.asarray(mapping), rngs, min_latency=min_latency, spawn=spawn)
@@ -0,0 +1,255 @@
+"""
+Sources of the transactions submitted during a simulation.  The network pulls one time step of transactions at a
+time, so streamed and generated schedules never have to be held in memory in full.
+
+Every source has peek_time() (time of the next transactions, or None once the schedule is exhausted) and pop()
+(the list of (sender id, data) submitted at that time).
+
+Usage:
+    python3 workload.py --tps [transactions per second] --txns [int] --nodes [int] --out schedules/[name].jsonl
+    writes a generated workload to a schedule file (.jsonl or .npy) that can be run with --schedule [name]
+"""
+from argparse import ArgumentParser
+import json
+import os
+
+import numpy as np
+
+SCHEDULE_DIR = "schedules"
+FORMATS = (".json", ".jsonl", ".npy")
+GENERATED = "poisson" # name of the schedule that is generated instead of read from a file
+
+
+def clean_up_json(data):
+    """
+    Takes a json with all values typed string, and re-assigns them to be of the correct type
+    (integer keys, with lists of [int, str])
+    """
+    clean_data = {}
+    for k, v in data.items():
+        new_v = []
+        for sender_id, txn_data in v:
+            new_v.append((int(sender_id), txn_data))
+        clean_data[int(k)] = new_v
+    return clean_data
+
+
+def transaction_data(index):
+    # data of the transactions in schedules that only store times and senders
+    return f"transaction {index}"
+
+
+class JsonSchedule:
+    """
+    Schedule stored as one json object mapping each time to the transactions submitted at that time.  The whole
+    file is loaded up front, and times are dropped as they are consumed
+    """
+    def __init__(self, path):
+        with open(path) as f:
+            self.actions = clean_up_json(json.load(f))
+        self.times = sorted(self.actions, reverse=True) # next time is at the end
+
+    def peek_time(self):
+        return self.times[-1] if self.times else None
+
+    def pop(self):
+        return self.actions.pop(self.times.pop())
+
+
+class JsonlSchedule:
+    """
+    Schedule stored as one [time, sender id, data] list per line, sorted by time.  Lines are read as they are
+    needed, keeping one line of lookahead
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.offset = 0 # position of the lookahead line in the file
+        self.next_action = self.read()
+
+    def read(self):
+        self.offset = self.file.tell()
+        line = self.file.readline()
+        while line and not line.strip():
+            self.offset = self.file.tell()
+            line = self.file.readline()
+        if not line:
+            return None
+        time, sender_id, data = json.loads(line)
+        return int(time), int(sender_id), data
+
+    def peek_time(self):
+        return self.next_action[0] if self.next_action is not None else None
+
+    def pop(self):
+        time = self.next_action[0]
+        actions = []
+        while self.next_action is not None and self.next_action[0] == time:
+            actions.append(self.next_action[1:])
+            self.next_action = self.read()
+        if self.next_action is not None and self.next_action[0] < time:
+            raise Exception(f"Schedule {self.path} is not sorted by time: {self.next_action[0]} comes after {time}")
+        return actions
+
+    def __getstate__(self):
+        # the file is reopened at the lookahead line when resuming
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.file = open(self.path, 'rb')
+        self.file.seek(self.offset)
+        self.next_action = self.read()
+
+
+class NpySchedule:
+    """
+    Schedule stored as a (2, transactions) integer array holding the times, sorted, and the sender ids of the
+    transactions.  The array is memory mapped, and the data of the i-th transaction is "transaction i"
+    """
+    def __init__(self, path):
+        self.path = path
+        self.times, self.senders = np.load(path, mmap_mode='r')
+        self.index = 0 # next transaction to submit
+
+    def peek_time(self):
+        return int(self.times[self.index]) if self.index < len(self.times) else None
+
+    def pop(self):
+        time = self.times[self.index]
+        end = int(np.searchsorted(self.times, time, side='right'))
+        actions = [(int(sender_id), transaction_data(i)) for i, sender_id in zip(range(self.index, end), self.senders[self.index:end])]
+        self.index = end
+        return actions
+
+    def __getstate__(self):
+        # the array is mapped again when resuming
+        state = self.__dict__.copy()
+        state['times'] = None
+        state['senders'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.times, self.senders = np.load(self.path, mmap_mode='r')
+
+
+class PoissonWorkload:
+    """
+    Open-loop workload: transactions arrive as a Poisson process at the given rate (transactions per second),
+    from senders drawn uniformly or from a zipf distribution over the nodes (node 0 sends the most).  Arrivals
+    are generated in batches as the schedule is consumed
+    """
+    def __init__(self, tps, num_txns, num_nodes, senders="uniform", zipf_exponent=1.0, rng=None, batch_size=4096):
+        if tps <= 0:
+            raise Exception(f"Transactions per second must be positive, got {tps}")
+        if senders == "uniform":
+            self.weights = None
+        elif senders == "zipf":
+            weights = 1 / np.arange(1, num_nodes + 1) ** zipf_exponent
+            self.weights = weights / weights.sum()
+        else:
+            raise Exception(f"Invalid sender distribution: {senders} does not exist!  Try using 'uniform' or 'zipf'")
+        self.mean_gap = 1000 / tps # ms between arrivals
+        self.num_txns = num_txns
+        self.num_nodes = num_nodes
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.batch_size = batch_size
+        self.clock = 0.0 # arrival time of the last generated transaction
+        self.generated = 0 # transactions generated so far
+        self.times = np.zeros(0, dtype=np.int64) # current batch of arrivals
+        self.senders = np.zeros(0, dtype=np.int64)
+        self.pos = 0 # next arrival in the batch
+
+    def refill(self):
+        n = min(self.batch_size, self.num_txns - self.generated)
+        arrivals = self.clock + np.cumsum(self.rng.exponential(self.mean_gap, n))
+        self.clock = arrivals[-1]
+        self.times = arrivals.astype(np.int64)
+        if self.weights is None:
+            self.senders = self.rng.integers(0, self.num_nodes, n)
+        else:
+            self.senders = self.rng.choice(self.num_nodes, n, p=self.weights)
+        self.pos = 0
+        self.generated += n
+
+    def peek_time(self):
+        if self.pos == len(self.times):
+            if self.generated == self.num_txns:
+                return None
+            self.refill()
+        return int(self.times[self.pos])
+
+    def pop(self):
+        time = self.peek_time()
+        actions = []
+        while self.peek_time() == time:
+            index = self.generated - len(self.times) + self.pos
+            actions.append((int(self.senders[self.pos]), transaction_data(index)))
+            self.pos += 1
+        return actions
+
+
+def schedule_path(name):
+    """
+    File in the schedules directory holding the schedule with the given name, in any of the supported formats
+    """
+    for ext in FORMATS:
+        path = os.path.join(SCHEDULE_DIR, name + ext)
+        if os.path.exists(path):
+            return path
+    raise Exception(f"Invalid schedule: no {' / '.join(name + ext for ext in FORMATS)} in {SCHEDULE_DIR}")
+
+
+def open_schedule(name, num_nodes, rng=None, tps=None, num_txns=None, senders="uniform", zipf_exponent=1.0):
+    """
+    Returns the source for the schedule with the given name, generating a Poisson workload for "poisson"
+    """
+    if name == GENERATED:
+        if tps is None or num_txns is None:
+            raise Exception("A generated workload needs both --tps and --txns")
+        return PoissonWorkload(tps, num_txns, num_nodes, senders, zipf_exponent, rng)
+    path = schedule_path(name)
+    if path.endswith(".jsonl"):
+        return JsonlSchedule(path)
+    if path.endswith(".npy"):
+        return NpySchedule(path)
+    return JsonSchedule(path)
+
+
+def write_schedule(source, path):
+    """
+    Writes every transaction of a schedule source to a .jsonl or .npy schedule file
+    """
+    if path.endswith(".jsonl"):
+        with open(path, 'w') as f:
+            while source.peek_time() is not None:
+                time = source.peek_time()
+                for sender_id, data in source.pop():
+                    f.write(json.dumps([time, sender_id, data]) + "\n")
+    elif path.endswith(".npy"):
+        times, senders = [], []
+        while source.peek_time() is not None:
+            time = source.peek_time()
+            for sender_id, _ in source.pop():
+                times.append(time)
+                senders.append(sender_id)
+        np.save(path, np.array([times, senders], dtype=np.int64).reshape(2, -1))
+    else:
+        raise Exception(f"Invalid schedule file: {path} should end in .jsonl or .npy")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Writes a generated workload to a schedule file")
+    parser.add_argument('--tps', type=float, help="Average number of transactions submitted per second", required=True)
+    parser.add_argument('--txns', type=int, help="Number of transactions to generate", required=True)
+    parser.add_argument('--nodes', type=int, help="Number of nodes sending transactions", default=5)
+    parser.add_argument('--senders', type=str, help="Distribution of senders: uniform or zipf", default="uniform")
+    parser.add_argument('--zipf-exponent', type=float, help="Exponent of the zipf sender distribution", default=1.0)
+    parser.add_argument('--seed', type=int, help="Seed for the generated arrivals", default=None)
+    parser.add_argument('--out', type=str, help="Schedule file to write (.jsonl or .npy)", required=True)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    write_schedule(PoissonWorkload(args.tps, args.txns, args.nodes, args.senders, args.zipf_exponent, rng), args.out)